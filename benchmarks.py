@@ -0,0 +1,254 @@
+"""
+Benchmarks of both pipelines on reproducible synthetic data:
+
+    python benchmarks.py [--quick] [--json OUT] [--compare BASELINE] [raw tabula csv ...]
+
+- page: OCR layout of a single Vision page, `Page` -> `ReportPage.padded_lines`
+- report: a whole Vision response file through `main.parse_report`, cold (the geometry sidecar is built from
+  the JSON) and warm (the sidecar is reused)
+- tabula: raw tabula CSV rows through `parser.sicknesses_from_rows`, as `load_sicknesses` does
+- cells: tabula number parsing alone; given raw tabula CSVs (e.g. a whole year of `tabula.convert_into`
+  output) it runs on their cells instead of synthetic ones
+- startup: a fresh interpreter running `cli.py --help`, `cli.py parse --help` and importing the tests
+
+Every benchmark reports the best of a few runs and the peak memory traced in a separate run - except startup,
+where nothing is traced (nan). Data is generated by `fixtures.py` from fixed seeds, so results saved with
+`--json` on one commit can be compared with `--compare` on another.
+"""
+import typing as t
+import argparse
+import csv
+import os
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from json import dumps, loads
+from tempfile import TemporaryDirectory
+from timeit import repeat
+
+from fixtures import synthetic_page, synthetic_document, synthetic_tabula_rows, synthetic_cells
+from helpers import stripped
+from visionary import Page, Geometry
+from main import ReportPage, ReportFile, parse_report
+from parser import parse_values, sicknesses_from_rows
+
+STARTUP_COMMANDS = {
+    'startup/cli --help': ['cli.py', '--help'],
+    'startup/cli parse --help': ['cli.py', 'parse', '--help'],
+    'startup/import tests': ['-c', 'import tests'],
+}
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_page(raw: t.Dict[str, t.Any]) -> t.List[str]:
+    """
+    what `main.main` does with a single page
+    """
+    return [str(line) for line in ReportPage(Page('synthetic.json', raw)).padded_lines]
+
+
+def bench_page(rows: int, number: int = 5) -> float:
+    """
+    :return: best per-page time in seconds
+    """
+    raw = synthetic_page(rows)
+    return min(repeat(lambda: parse_page(raw), number=number, repeat=3)) / number
+
+
+def raw_cells(paths: t.Iterable[str]) -> t.List[str]:
+    """
+    :return: value cells of raw tabula CSVs - everything but the first (name) column of each row
+    """
+    cells = []
+    for path in paths:
+        with open(path) as f:
+            cells.extend(cell for row in stripped(csv.reader(f)) for cell in row[1:])
+    return cells
+
+
+def _parse_cells(cells: t.List[str]):
+    for cell in cells:
+        try:
+            parse_values([cell])
+        except (ValueError, IndexError):
+            pass
+
+
+def bench_cells(cells: t.List[str]) -> float:
+    """
+    :return: best time in seconds to parse every cell, skipping cells the parser rejects
+    """
+    return min(repeat(lambda: _parse_cells(cells), number=1, repeat=3))
+
+
+class Result(t.NamedTuple):
+    seconds: float  # best run
+    items: int  # pages, entries, rows or cells processed by a run
+    unit: str
+    peak_mb: float
+
+    @property
+    def throughput(self) -> float:
+        return self.items / self.seconds
+
+
+def _best(func: t.Callable[[], t.Any], number: int = 1, runs: int = 3) -> float:
+    return min(repeat(func, number=number, repeat=runs)) / number
+
+
+def _peak_mb(func: t.Callable[[], t.Any]) -> float:
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / (1 << 20)
+    finally:
+        tracemalloc.stop()
+
+
+@contextmanager
+def _working_directory(path: str):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def bench_report(pages: int, rows: int, runs: int = 3) -> t.Tuple[Result, Result]:
+    """
+    :return: cold and warm results of `main.parse_report` on a synthetic response saved to ./result
+    """
+    report = ReportFile('1.01.2000-31.12.2000.pdf')
+    with TemporaryDirectory() as tmp, _working_directory(tmp):
+        os.mkdir('result')
+        with open(report._json_path, 'w') as f:
+            f.write(dumps(synthetic_document(pages, rows), indent=2))
+        entries = len(parse_report(report.pdf_path))
+
+        def _cold():
+            shutil.rmtree(Geometry.path(report._json_path))
+            parse_report(report.pdf_path)
+
+        def _warm():
+            parse_report(report.pdf_path)
+
+        cold = Result(_best(_cold, runs=runs), entries, 'entries', _peak_mb(_cold))
+        warm = Result(_best(_warm, runs=runs), entries, 'entries', _peak_mb(_warm))
+    return cold, warm
+
+
+def bench_tabula(rows: int, runs: int = 3) -> Result:
+    """
+    reads a synthetic raw tabula CSV and parses its rows the way `load_sicknesses` does
+    """
+    with TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'table.csv')
+        with open(path, 'w', newline='') as f:
+            csv.writer(f).writerows(synthetic_tabula_rows(rows))
+
+        def _parse() -> int:
+            with open(path, newline='') as f:
+                return sum(1 for _ in sicknesses_from_rows(csv.reader(f)))
+
+        return Result(_best(_parse, runs=runs), _parse(), 'rows', _peak_mb(_parse))
+
+
+def _spawn(args: t.List[str]) -> float:
+    """
+    :return: wall time of a fresh interpreter running `args` from this directory
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, *args], cwd=HERE, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def bench_startup(args: t.List[str], runs: int = 5) -> Result:
+    return Result(min(_spawn(args) for _ in range(runs)), 1, 'runs', float('nan'))
+
+
+def run(csv_paths: t.List[str], quick: bool = False) -> t.Dict[str, Result]:
+    runs = 1 if quick else 3
+    results: t.Dict[str, Result] = {}
+
+    for rows in (10, 100) if quick else (10, 50, 100, 200):
+        raw = synthetic_page(rows)
+        results[f'page/{rows} rows'] = Result(
+            bench_page(rows, number=1 if quick else 5), 1, 'pages', _peak_mb(lambda: parse_page(raw))
+        )
+
+    for pages, rows in ((2, 50),) if quick else ((2, 50), (10, 100), (40, 200)):
+        cold, warm = bench_report(pages, rows, runs)
+        results[f'report/{pages}x{rows} cold'] = cold
+        results[f'report/{pages}x{rows} warm'] = warm
+
+    for rows in (1000,) if quick else (1000, 10000, 100000):
+        results[f'tabula/{rows} rows'] = bench_tabula(rows, runs)
+
+    for name, args in STARTUP_COMMANDS.items():
+        results[name] = bench_startup(args, runs=1 if quick else 5)
+
+    cells = raw_cells(csv_paths) if csv_paths else synthetic_cells()
+    results[f'cells/{"raw" if csv_paths else "synthetic"}'] = Result(
+        bench_cells(cells), len(cells), 'cells', _peak_mb(lambda: _parse_cells(cells))
+    )
+    return results
+
+
+def _commit() -> t.Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report_table(results: t.Dict[str, Result], baseline: t.Optional[t.Dict[str, t.Any]] = None) -> str:
+    """
+    :param baseline: results saved with `--json`; adds how many times faster each benchmark got
+    """
+    header = f'{"benchmark":<28}{"ms":>10}{"per second":>16}{"peak MB":>10}'
+    rows = [header + (f'{"speedup":>10}' if baseline else '')]
+    for name, result in results.items():
+        per_second = f'{result.throughput:,.0f} {result.unit}'
+        row = f'{name:<28}{result.seconds * 1000:>10.2f}{per_second:>16}{result.peak_mb:>10.1f}'
+        if baseline and name in baseline['results']:
+            row += f'{baseline["results"][name]["seconds"] / result.seconds:>9.2f}x'
+        rows.append(row)
+    return '\n'.join(rows)
+
+
+parser = argparse.ArgumentParser(description='Benchmarks both pipelines on synthetic data.')
+parser.add_argument('csv_paths', nargs='*', help='raw tabula CSVs to parse numbers of instead of synthetic cells')
+parser.add_argument('--quick', action='store_true', help='smaller sizes and single runs, for a smoke test')
+parser.add_argument('--json', type=str, help='save results to this file')
+parser.add_argument('--compare', type=str, help='results saved with --json to compare with')
+
+
+def main(argv: t.Optional[t.List[str]] = None):
+    args = parser.parse_args(argv)
+    results = run(args.csv_paths, args.quick)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = loads(f.read())
+        print(f'compared with {args.compare} ({baseline.get("commit") or "unknown commit"})')
+    print(report_table(results, baseline))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            f.write(dumps({
+                'commit': _commit(),
+                'results': {
+                    name: {**result._asdict(), 'throughput': result.throughput} for name, result in results.items()
+                },
+            }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
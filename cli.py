@@ -0,0 +1,43 @@
+"""
+Single entry point for every step of the pipeline:
+
+    python cli.py <command> [args ...]
+    python cli.py <command> --help
+
+A command's module - and whatever it depends on: requests, tabula, numpy - is imported only when that
+command runs, so listing the commands costs next to nothing.
+"""
+import typing as t
+import argparse
+from importlib import import_module
+
+COMMANDS: t.Dict[str, t.Tuple[str, str]] = {
+    'download': ('downloader:cli', 'download SANEPID™ reports to ./downloads'),
+    'annotate': ('get_annotations:cli', 'OCR downloaded reports with Google Vision into ./result'),
+    'extract': ('parser:cli', 'download reports and extract their tables with tabula'),
+    'parse': ('main:cli', 'parse OCR results into sickness entries'),
+    'group': ('group_json:cli', 'group parsed entries by date and sickness'),
+    'query': ('query:main', 'query grouped entries'),
+}
+
+parser = argparse.ArgumentParser(
+    prog='cli.py',
+    description='Infestation™ PL-edition™ - computer-friendly SANEPID™ data.',
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    epilog='commands:\n' + '\n'.join(f'  {name:<10}{help_}' for name, (_, help_) in COMMANDS.items()),
+)
+parser.add_argument('command', choices=list(COMMANDS), metavar='command', help='one of the commands below')
+parser.add_argument('args', nargs=argparse.REMAINDER, help='arguments of the command, see <command> --help')
+
+
+def main(argv: t.Optional[t.List[str]] = None):
+    args = parser.parse_args(argv)
+    target, _ = COMMANDS[args.command]
+    module_name, function = target.split(':')
+    module = import_module(module_name)
+    module.parser.prog = f'{parser.prog} {args.command}'
+    getattr(module, function)(args.args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import typing as t
+import os
+
+import numpy as np
+
+CODES_SUFFIX = '.codes'
+CATEGORIES_SUFFIX = '.categories'
+
+
+class DictionaryColumn(t.NamedTuple):
+    """
+    strings stored once in `categories`, rows refer to them by index
+    """
+    codes: np.ndarray
+    categories: np.ndarray
+
+    @classmethod
+    def encode(cls, values: t.Iterable[t.Optional[str]]) -> 'DictionaryColumn':
+        index: t.Dict[str, int] = {}
+        codes = np.fromiter((index.setdefault(value or '', len(index)) for value in values), dtype=np.int32)
+        return cls(codes, np.array(list(index), dtype=str))
+
+    def decode(self) -> np.ndarray:
+        return self.categories[self.codes]
+
+
+Column = t.Union[np.ndarray, DictionaryColumn]
+
+
+def padded_matrix(rows: t.Sequence[t.Sequence[float]]) -> np.ndarray:
+    """
+    :return: float64 (len(rows), longest row) matrix, short rows padded with NaN
+    """
+    width = max(map(len, rows), default=0)
+    matrix = np.full((len(rows), width), np.nan)
+    for i, row in enumerate(rows):
+        matrix[i, :len(row)] = row
+    return matrix
+
+
+def save_columns(directory: str, columns: t.Dict[str, Column]):
+    """
+    one uncompressed .npy file per column (two for dictionary columns), so each can be memory-mapped
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name, column in columns.items():
+        if isinstance(column, DictionaryColumn):
+            np.save(os.path.join(directory, name + CODES_SUFFIX + '.npy'), column.codes)
+            np.save(os.path.join(directory, name + CATEGORIES_SUFFIX + '.npy'), column.categories)
+        else:
+            np.save(os.path.join(directory, name + '.npy'), column)
+
+
+def load_columns(directory: str, mmap_mode: t.Optional[str] = 'r') -> t.Dict[str, Column]:
+    """
+    columns are memory-mapped by default - nothing is read until it is used
+    """
+    columns: t.Dict[str, Column] = {}
+    for filename in sorted(os.listdir(directory)):
+        name, extension = os.path.splitext(filename)
+        if extension != '.npy' or name.endswith(CATEGORIES_SUFFIX):
+            continue
+
+        array = np.load(os.path.join(directory, filename), mmap_mode=mmap_mode)
+        if name.endswith(CODES_SUFFIX):
+            name = name[:-len(CODES_SUFFIX)]
+            categories = np.load(os.path.join(directory, name + CATEGORIES_SUFFIX + '.npy'), mmap_mode=mmap_mode)
+            columns[name] = DictionaryColumn(array, categories)
+        else:
+            columns[name] = array
+    return columns
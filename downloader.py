@@ -1,25 +1,60 @@
+from __future__ import annotations
 import typing as t
-import requests
+import os
 import re
-from bs4 import BeautifulSoup
-from subprocess import check_call
+import argparse
+import threading
+from json import loads, dumps
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+if t.TYPE_CHECKING:  # imported where used, so importing this module stays cheap
+    import requests
+    from bs4 import BeautifulSoup
 
 YEAR_REGEX = re.compile(r'\d\d\d\d')
 
 SOURCE_LINK = 'http://wwwold.pzh.gov.pl/oldpage/epimeld/index_p.html'
 BASE_LINK = SOURCE_LINK.split('epimeld')[0] + 'epimeld/'
 
+DOWNLOAD_DIR = './downloads'
+STATE_PATH = './download-state.json'
+DEFAULT_CONCURRENCY = 4
+CHUNK_SIZE = 1 << 16
+TIMEOUT = 30
+PARTIAL_SUFFIX = '.part'
+
+
+def make_session(pool_size: int = DEFAULT_CONCURRENCY) -> requests.Session:
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=3)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
 
-def link_directories() -> t.Generator[BeautifulSoup, None, None]:
-    r = requests.get(SOURCE_LINK)
+@lru_cache(maxsize=1)
+def default_session() -> requests.Session:
+    return make_session()
+
+
+def link_directories(session: t.Optional[requests.Session] = None) -> t.Generator[BeautifulSoup, None, None]:
+    from bs4 import BeautifulSoup
+
+    r = (session or default_session()).get(SOURCE_LINK, timeout=TIMEOUT)
     soup = BeautifulSoup(r.content, 'html.parser')
     for td in soup.find_all('td', class_='gora'):
         for link in td.parent.find_all('a'):
             yield link
 
 
-def pdf_links(link: str) -> t.Generator[BeautifulSoup, None, None]:
-    r = requests.get(link)
+def pdf_links(link: str, session: t.Optional[requests.Session] = None) -> t.Generator[BeautifulSoup, None, None]:
+    from bs4 import BeautifulSoup
+
+    r = (session or default_session()).get(link, timeout=TIMEOUT)
     soup = BeautifulSoup(r.content, 'html.parser')
     for pdf_link in soup.find_all('a'):
         try:
@@ -29,24 +64,136 @@ def pdf_links(link: str) -> t.Generator[BeautifulSoup, None, None]:
             pass
 
 
-def all_pdfs() -> t.Generator[t.Tuple[str, str], None, None]:
+def all_pdfs(session: t.Optional[requests.Session] = None) -> t.Generator[t.Tuple[str, str], None, None]:
     """
     :return: Generator[Tuple[
        daterange<str>: string with date of that pdf,
        link<str>: http link to that pdf
     ]]
     """
-    for subdir_link in link_directories():
+    for subdir_link in link_directories(session):
         year = YEAR_REGEX.search(subdir_link.text).group(0)
         base_link = BASE_LINK + subdir_link['href']
-        for link in pdf_links(base_link):
+        for link in pdf_links(base_link, session):
             start, end = link.text.replace(' ', '').split('-')
             date = f'{start}.{year}-{end}.{year}'
             yield date, base_link.rsplit('/', maxsplit=1)[0] + '/' + link['href']
 
 
-if __name__ == '__main__':
-    for name, link in all_pdfs():
-        check_call(['curl', link, '-o', f'./downloads/{name}.pdf'])
+def _validators(response: requests.Response) -> t.Dict[str, str]:
+    return {k: response.headers[h] for k, h in (('etag', 'ETag'), ('last_modified', 'Last-Modified'))
+            if h in response.headers}
+
+
+class Downloader:
+    """
+    Downloads pdfs through one pooled session with at most `concurrency` transfers in flight.
+
+    Files already on disk are revalidated with a conditional GET (or, without recorded validators, kept when
+    their size matches the remote one), and interrupted transfers continue from their `.part` file.
+    Validators are kept in `state_path`, so the downloads directory holds nothing but pdfs and the `.part` files
+    of interrupted transfers.
+    """
+    def __init__(
+            self,
+            directory: str = DOWNLOAD_DIR,
+            concurrency: int = DEFAULT_CONCURRENCY,
+            state_path: str = STATE_PATH,
+            session: t.Optional[requests.Session] = None,
+    ):
+        self.directory = directory
+        self.concurrency = concurrency
+        self.state_path = state_path
+        self.session = session or make_session(concurrency)
+        self._lock = threading.Lock()
+        try:
+            with open(state_path) as f:
+                self._state: t.Dict[str, t.Dict[str, str]] = loads(f.read())
+        except FileNotFoundError:
+            self._state = {}
+
+    def _record(self, link: str, validators: t.Dict[str, str]):
+        with self._lock:
+            self._state[link] = validators
+            with open(self.state_path, 'w') as f:
+                f.write(dumps(self._state, indent=2))
 
-        print(name, link)
+    def _conditional_headers(self, link: str) -> t.Dict[str, str]:
+        record = self._state.get(link, {})
+        headers = {}
+        if 'etag' in record:
+            headers['If-None-Match'] = record['etag']
+        if 'last_modified' in record:
+            headers['If-Modified-Since'] = record['last_modified']
+        return headers
+
+    def fetch(self, name: str, link: str) -> str:
+        """
+        :return: what happened to the file - DOWNLOADED, RESUMED, NOT MODIFIED or SKIPPED
+        """
+        path = os.path.join(self.directory, f'{name}.pdf')
+        partial_path = path + PARTIAL_SUFFIX
+        headers = {}
+
+        if os.path.exists(path):
+            if not self._state.get(link):  # nothing to revalidate with, neither now nor on later runs
+                head = self.session.head(link, timeout=TIMEOUT, allow_redirects=True)
+                head.raise_for_status()
+                if head.headers.get('Content-Length') == str(os.path.getsize(path)):
+                    self._record(link, _validators(head))
+                    return 'SKIPPED'
+            headers.update(self._conditional_headers(link))
+
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            record = self._state.get(link, {})
+            if_range = record.get('etag') or record.get('last_modified')
+            if if_range:
+                headers['If-Range'] = if_range
+
+        with self.session.get(link, headers=headers, stream=True, timeout=TIMEOUT) as response:
+            if response.status_code == 304:
+                return 'NOT MODIFIED'
+            response.raise_for_status()
+
+            resumed = response.status_code == 206
+            self._record(link, _validators(response))
+            with open(partial_path, 'ab' if resumed else 'wb') as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+
+        os.replace(partial_path, path)
+        return 'RESUMED' if resumed else 'DOWNLOADED'
+
+    def fetch_all(self, pdfs: t.Iterable[t.Tuple[str, str]]) -> t.Iterator[t.Tuple[str, str]]:
+        """
+        :return: (name, status) in the order of `pdfs`
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            pdfs = list(pdfs)
+            statuses = executor.map(lambda pdf: self.fetch(*pdf), pdfs)
+            yield from zip((name for name, link in pdfs), statuses)
+
+
+parser = argparse.ArgumentParser(description='Downloads SANEPID™ reports.')
+
+parser.add_argument(
+    '--jobs',
+    type=int,
+    default=DEFAULT_CONCURRENCY,
+    help=f'number of concurrent downloads, defaults to {DEFAULT_CONCURRENCY}'
+)
+
+
+def cli(argv: t.Optional[t.List[str]] = None):
+    args = parser.parse_args(argv)
+    downloader = Downloader(concurrency=args.jobs)
+
+    for name, status in downloader.fetch_all(all_pdfs(downloader.session)):
+        print(f'{name} [{status}]')
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,164 @@
+"""
+Synthetic Vision responses and raw tabula tables, generated from fixed seeds - shared by the tests and
+`benchmarks.py`.
+"""
+import typing as t
+import random
+
+SICKNESS_NAMES = [
+    'Cholera UE',
+    'Dur brzuszny UE',
+    'Dury rzekome A, B, C UE',
+    'Czerwonka bakteryjna (szigeloza) UE',
+    'zatrucie pokarmowe UE/PL',
+    'posocznica PL',
+    'inne zakażenie pozajelitowe PL',
+    'Grypa i podejrzenia grypy UE',
+]
+FILLER_WORDS = ['ogółem', 'inne', 'wywołane', 'przez', 'UE', 'PL']
+REPORTS_PER_YEAR = 24
+ROWS_PER_REPORT = 250
+ROW_HEIGHT = 0.02
+WORD_HEIGHT = 0.012
+CHAR_WIDTH = 0.006
+VALUES_LEFT = 0.55
+VALUES_SPACING = 0.1
+
+
+def _bounding_box(left: float, top: float, right: float, bottom: float) -> t.Dict[str, t.Any]:
+    return {
+        'normalizedVertices': [
+            {'x': left, 'y': top},
+            {'x': right, 'y': top},
+            {'x': right, 'y': bottom},
+            {'x': left, 'y': bottom},
+        ]
+    }
+
+
+def synthetic_word(text: str, left: float, top: float) -> t.Dict[str, t.Any]:
+    symbols = [
+        {
+            'boundingBox': _bounding_box(
+                left + i * CHAR_WIDTH, top, left + (i + 1) * CHAR_WIDTH, top + WORD_HEIGHT
+            ),
+            'text': ch,
+            'confidence': 0.99,
+        }
+        for i, ch in enumerate(text)
+    ]
+    return {
+        'boundingBox': _bounding_box(left, top, left + len(text) * CHAR_WIDTH, top + WORD_HEIGHT),
+        'symbols': symbols,
+        'confidence': 0.99,
+    }
+
+
+def synthetic_row(index: int, top: float, rng: random.Random, extra_words: int = 0) -> t.List[t.Dict[str, t.Any]]:
+    """
+    :param extra_words: filler words added to the sickness name, for longer lines
+    """
+    words = []
+    left = 0.05
+    for text in [str(index), *rng.choice(SICKNESS_NAMES).split(), *rng.choices(FILLER_WORDS, k=extra_words)]:
+        words.append(synthetic_word(text, left, top))
+        left += (len(text) + 1) * CHAR_WIDTH
+
+    values = [
+        str(rng.randint(0, 999)),
+        f'{rng.randint(0, 99)},{rng.randint(0, 99):02}',
+        str(rng.randint(0, 999)),
+        f'{rng.randint(0, 99)},{rng.randint(0, 99):02}',
+    ]
+    for i, text in enumerate(values):
+        words.append(synthetic_word(text, VALUES_LEFT + i * VALUES_SPACING, top))
+
+    return words
+
+
+def page_of_words(words: t.List[t.Dict[str, t.Any]], page_number: int = 1) -> t.Dict[str, t.Any]:
+    """
+    :return: a single entry of Vision `responses[0]['responses']` holding `words` in one paragraph
+    """
+    paragraph = {'boundingBox': _bounding_box(0, 0, 1, 1), 'words': words, 'confidence': 0.9}
+    block = {
+        'boundingBox': _bounding_box(0, 0, 1, 1),
+        'blockType': 'TEXT',
+        'confidence': 0.9,
+        'paragraphs': [paragraph],
+    }
+    return {
+        'fullTextAnnotation': {
+            'text': '',
+            'pages': [{'width': 1, 'height': 1, 'confidence': 0.9, 'blocks': [block]}],
+        },
+        'context': {'pageNumber': page_number},
+    }
+
+
+def synthetic_page(rows: int, page_number: int = 1, seed: int = 0, extra_words: int = 0) -> t.Dict[str, t.Any]:
+    """
+    :return: a single entry of Vision `responses[0]['responses']` with `rows` table rows
+    """
+    rng = random.Random(seed)
+    words = [
+        word
+        for i in range(rows)
+        for word in synthetic_row(i + 1, 0.05 + i * ROW_HEIGHT, rng, extra_words)
+    ]
+    return page_of_words(words, page_number)
+
+
+def synthetic_document(pages: int, rows: int, seed: int = 0, extra_words: int = 0) -> t.Dict[str, t.Any]:
+    """
+    :return: a whole Vision response as `get_annotations` saves it
+    """
+    return {
+        'responses': [
+            {
+                'inputConfig': {'gcsSource': {'uri': 'gs://synthetic/report.pdf'}, 'mimeType': 'application/pdf'},
+                'responses': [synthetic_page(rows, i + 1, seed + i, extra_words) for i in range(pages)],
+                'totalPages': pages,
+            }
+        ]
+    }
+
+
+def synthetic_tabula_rows(rows: int, seed: int = 0) -> t.List[t.List[str]]:
+    """
+    :return: a raw tabula table as `TableExtractor.rows` returns it: years, two header rows, then sicknesses
+        with cells of count and incidence, thousands split by spaces and null markers
+    """
+    rng = random.Random(seed)
+
+    def _cell() -> str:
+        if rng.random() < 0.1:
+            return '– –'
+        return f'{_tabula_number(rng)} {rng.randint(0, 99)},{rng.randint(0, 99):02}'
+
+    table = [['1.01-31.10.2018 r.', '1.01-31.10.2017 r.'], ['Liczba Zapad.', 'Liczba Zapad.'], ['1', '2', '3']]
+    for i in range(rows):
+        name = rng.choice(SICKNESS_NAMES)
+        # every third row a sickness, the rest its subcategories - told apart by the case of the first letter
+        first = name[0].upper() if i % 3 == 0 else name[0].lower()
+        table.append([f'{i + 1} {first}{name[1:]}', _cell(), _cell()])
+    return table
+
+
+def _tabula_number(rng: random.Random, decimals: int = 0) -> str:
+    number = f'{rng.randint(0, 30000):,}'.replace(',', ' ')
+    return f'{number},{rng.randint(0, 99):02}' if decimals else number
+
+
+def synthetic_cell(rng: random.Random) -> str:
+    """
+    :return: a raw tabula cell: count and incidence, with thousands split by spaces and null markers
+    """
+    if rng.random() < 0.1:
+        return '–'
+    return f'{_tabula_number(rng)} {_tabula_number(rng, decimals=2)}'
+
+
+def synthetic_cells(reports: int = REPORTS_PER_YEAR, rows: int = ROWS_PER_REPORT, seed: int = 0) -> t.List[str]:
+    rng = random.Random(seed)
+    return [synthetic_cell(rng) for _ in range(reports * rows * 2)]
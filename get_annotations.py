@@ -1,19 +1,31 @@
-from typing import Dict, Any, Iterable
+from typing import Dict, Any, Iterable, List, Iterator, Tuple, Optional
 
+import os
+import time
+import argparse
 from os import listdir
-from requests import post
-import grequests
-from grequests import post, map
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from json import dumps
 
 
 GOOGLE_URL = 'https://vision.googleapis.com/v1/files:annotate'
+DOWNLOAD_DIR = './downloads'
+RESULT_DIR = './result'
 
+MAX_IN_FLIGHT = 4
+BATCH_SIZE = 1  # files:annotate currently accepts a single file per request
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+TIMEOUT = 300  # files:annotate answers only once the whole file is OCRed
 
-def exception_handler(request, exception):
-    print("Request failed")
 
+class AnnotationException(Exception):
+    pass
 
+
+@lru_cache(maxsize=1)
 def get_token() -> str:
     with open('./token.txt') as f:
         return f.read().strip()
@@ -30,58 +42,151 @@ def storage_file_path(filename: str) -> str:
     return f'gs://sanepid-data-infestation/as-of-06-12-2019/{filename}'
 
 
-def annotate_file_request(filename: str) -> Dict[str, Any]:
+def annotate_file_config(filename: str) -> Dict[str, Any]:
     return {
-        "requests": [
+        "inputConfig": {
+            "gcsSource": {
+                "uri": storage_file_path(filename)
+            },
+            "mimeType": "application/pdf"
+        },
+        "features": [
             {
-                "inputConfig": {
-                    "gcsSource": {
-                        "uri": storage_file_path(filename)
-                    },
-                    "mimeType": "application/pdf"
-                },
-                "features": [
-                    {
-                        "type": "DOCUMENT_TEXT_DETECTION"
-                    }
-                ],
-                # "pages": [
-                #     1, 2, 3, 4, 5
-                # ]
+                "type": "DOCUMENT_TEXT_DETECTION"
             }
-        ]
+        ],
+        # "pages": [
+        #     1, 2, 3, 4, 5
+        # ]
     }
 
 
-def extract_file_text(filename: str) -> Dict:
-    response = post(
-        GOOGLE_URL,
-        data=dumps(annotate_file_request(filename)),
-        headers=auth_headers(get_token()),
-    )
+def annotate_files_request(filenames: List[str]) -> Dict[str, Any]:
+    return {"requests": [annotate_file_config(filename) for filename in filenames]}
+
 
-    return response.json()
+def annotate_file_request(filename: str) -> Dict[str, Any]:
+    return annotate_files_request([filename])
+
+
+def result_path(filename: str, result_dir: str = RESULT_DIR) -> str:
+    basename, extension = filename.rsplit('.', 1)
+    return f'{result_dir}/{basename}.json'
+
+
+def batched(items: List[str], size: int) -> Iterator[List[str]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class Annotator:
+    """
+    Sends `files:annotate` requests through one pooled session, at most `in_flight` at a time, retrying
+    rate-limited, failed, timed out and dropped requests with exponential backoff (or the server's Retry-After).
+    """
+    def __init__(
+            self,
+            token: str,
+            url: str = GOOGLE_URL,
+            in_flight: int = MAX_IN_FLIGHT,
+            batch_size: int = BATCH_SIZE,
+            max_retries: int = MAX_RETRIES,
+            backoff: float = BACKOFF_SECONDS,
+            timeout: float = TIMEOUT,
+    ):
+        self.url = url
+        self.in_flight = in_flight
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        self.session.headers.update(auth_headers(token))
+        self.session.mount(url, HTTPAdapter(pool_connections=1, pool_maxsize=in_flight))
+
+    def _post(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        import requests
+
+        data = dumps(body)
+        for attempt in range(self.max_retries + 1):
+            delay = self.backoff * 2 ** attempt
+            try:
+                response = self.session.post(self.url, data=data, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise AnnotationException(f'{self.url} did not respond: {e}') from e
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    break
+                retry_after = response.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    delay = float(retry_after)
+            time.sleep(delay)
+
+        if not response.ok:
+            raise AnnotationException(f'{self.url} responded {response.status_code}: {response.text[:200]}')
+        return response.json()
+
+    def extract_files_text(self, filenames: List[str]) -> List[Dict[str, Any]]:
+        """
+        :return: one response per file, each shaped like a single-file `files:annotate` response
+        """
+        data = self._post(annotate_files_request(filenames))
+        return [{'responses': [response]} for response in data['responses']]
+
+    def annotate(self, filenames: Iterable[str], result_dir: str = RESULT_DIR) -> Iterator[Tuple[str, str]]:
+        """
+        skips files which already have a result, writes the others as their batch completes
+
+        :return: (filename, result path), in the order of `filenames`
+        """
+        pending = [f for f in filenames if not os.path.exists(result_path(f, result_dir))]
+
+        def _annotate_batch(batch: List[str]) -> List[Tuple[str, str]]:
+            written = []
+            for filename, data in zip(batch, self.extract_files_text(batch)):
+                outpath = result_path(filename, result_dir)
+                with open(outpath, 'w') as f:
+                    f.write(dumps(data, indent=2))
+                written.append((filename, outpath))
+            return written
+
+        with ThreadPoolExecutor(self.in_flight) as executor:
+            for written in executor.map(_annotate_batch, batched(pending, self.batch_size)):
+                yield from written
 
 
-def main():
-    files: Iterable[str] = listdir('./downloads')
+def extract_file_text(filename: str) -> Dict:
+    return Annotator(get_token()).extract_files_text([filename])[0]
 
-    print(auth_headers(get_token()))
 
-    # with open(f'./result/{files[0]}', 'w') as f:
-    #     f.write(dumps(data))
+parser = argparse.ArgumentParser(description='Annotates downloaded reports with Google Vision OCR.')
 
-    for file in files:
-        basename, extension = file.rsplit('.', 1)
-        outpath = f'./result/{basename}.json'
+parser.add_argument(
+    '--jobs',
+    type=int,
+    default=MAX_IN_FLIGHT,
+    help=f'number of requests in flight, defaults to {MAX_IN_FLIGHT}'
+)
 
-        data = extract_file_text(file)
 
-        with open(outpath, 'w') as f:
-            f.write(dumps(data, indent=2))
+def main(jobs: int = MAX_IN_FLIGHT):
+    # only finished downloads - the downloader keeps interrupted ones there as .pdf.part
+    files: Iterable[str] = [file for file in listdir(DOWNLOAD_DIR) if file.endswith('.pdf')]
+    annotator = Annotator(get_token(), in_flight=jobs)
 
+    for file, outpath in annotator.annotate(files):
         print(f'{file} -> {outpath} [OK]')
 
 
+def cli(argv: Optional[List[str]] = None):
+    args = parser.parse_args(argv)
+    main(jobs=args.jobs)
+
+
 if __name__ == '__main__':
-    main()
+    cli()
@@ -1,12 +1,17 @@
 import typing as t
-from json import loads, dumps
-from itertools import groupby
+import argparse
+from json import dumps
 
+from periods import normalize_periods
+from store import SicknessStore
+from writers import read_entries
 
-def _get_response() -> str:
-    with open('./response.json') as f:
+RESPONSE_PATH = './response.json'
+STORE_PATH = './grouped-response.store'
 
-        return f.read()
+
+def _get_response(path: str = RESPONSE_PATH) -> t.Iterator[dict]:
+    return read_entries(path)
 
 
 def _save_response(data: dict):
@@ -14,20 +19,38 @@ def _save_response(data: dict):
         f.write(dumps(data))
 
 
-def by_sickness(values: t.Iterable) -> dict:
-    return {k: v for k, v in ((v['name'], v['per_30_days']) for v in values)}
+def sicknesses_by_date(entries: t.Iterable[dict]) -> t.Dict[str, t.Any]:
+    return SicknessStore.from_entries(entries).to_dict()
+
 
+parser = argparse.ArgumentParser(description='Groups parsed sickness entries by date.')
 
-def sicknesses_by_date(entries: t.Iterable[dict]) -> t.Dict[str, t.Any]:
-    all_sicknesses = {e['name']: 0 for e in entries}
-    return {k: {**all_sicknesses, **by_sickness(v)} for k, v in groupby(entries, key=lambda x: x['measured'])}
+parser.add_argument(
+    'source',
+    type=str,
+    nargs='?',
+    default=RESPONSE_PATH,
+    help=f'main.py output, JSON array or JSON Lines (.ndjson/.jsonl), defaults to {RESPONSE_PATH}'
+)
+
+parser.add_argument(
+    '--normalize-periods',
+    action='store_true',
+    help='replace overlapping reports with non-overlapping period increments before grouping'
+)
+
+
+def main(source: str = RESPONSE_PATH, normalize: bool = False):
+    entries = _get_response(source)
+    store = SicknessStore.from_entries(normalize_periods(entries) if normalize else entries)
+    store.save(STORE_PATH)
+    _save_response(store.to_dict())
 
 
-def main():
-    data = loads(_get_response())
-    formatted = sicknesses_by_date(data)
-    _save_response(formatted)
+def cli(argv: t.Optional[t.List[str]] = None):
+    args = parser.parse_args(argv)
+    main(args.source, args.normalize_periods)
 
 
 if __name__ == '__main__':
-    main()
+    cli()
@@ -1,23 +1,34 @@
 from os.path import basename
 import typing as t
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from dataclasses import dataclass
-from os import listdir
-from itertools import chain
+from functools import cached_property
+from os import scandir, environ
 import statistics
-from json import dumps
 
+from manifest import Manifest, MANIFEST_PATH
+from names import NameCanonicalizer, ALIASES_PATH
+from profiling import profiler, profiling, profile_output, PROFILE_ENV
 from models import SicknessEntry
-from visionary import DocumentFile, Page, parse_date, Line, Word, PaddedLine
+from tables import Table
+from visionary import DocumentFile, Page, PageLayout, parse_date, Line, Word, PaddedLine
+from writers import WRITERS, Entry
 
 WEIRD_HYPHENS = ['–']
 IGNORE_CHARACTERS = [',', ' ']
+DATA_ENTRY_TRANSLATION = str.maketrans('', '', ''.join(IGNORE_CHARACTERS))
+DASHES = {'-', *WEIRD_HYPHENS}
 
 PDF_DIR = './downloads'
+DEFAULT_FORMAT = 'json'
+PARSER_VERSION = 4  # bump whenever the entries produced for an unchanged report change
 
 
 @dataclass(frozen=True, eq=True)
 class ReportPage:
-    raw: Page
+    raw: PageLayout
 
     @staticmethod
     def _is_stat_line(line: Line) -> bool:
@@ -27,41 +38,65 @@ class ReportPage:
 
     @staticmethod
     def _is_data_entry(word: Word) -> bool:
-        word = str(word).strip()
-        for ch in IGNORE_CHARACTERS:
-            word = word.replace(ch, '')
-
-        for ch in WEIRD_HYPHENS:
-            word = word.replace(ch, '-')
-
-        return word.isnumeric() or word == '-'
+        word = str(word).strip().translate(DATA_ENTRY_TRANSLATION)
+        return word.isnumeric() or word in DASHES
+
+    @cached_property
+    def _stat_lines(self) -> t.Tuple[t.List[Line], float]:
+        """
+        a single pass over the page's lines: keeps the stat lines, finds the widest of them and collects
+        the symbol widths the char width is the median of.
+        Lines are read through the page's value columns when there are some, so numbers OCR split into
+        several words still give one value; lines the columns cannot explain fall back to `_is_stat_line`.
+        :return: stat lines and the char width used to pad them
+        """
+        lines: t.List[Line] = []
+        longest: t.Optional[Line] = None
+        symbol_widths: t.List[float] = []
+        with profiler.stage('lines'):
+            page_lines = list(self.raw.lines)
+        with profiler.stage('table'):
+            table = Table.infer(page_lines, ReportPage._is_data_entry)
+
+        with profiler.stage('filter'):
+            for line in page_lines:
+                row = table.row(line) if table else None
+                if row is None and ReportPage._is_stat_line(line):
+                    row = line
+                if row is None:
+                    continue
+
+                lines.append(row)
+                if longest is None or row.width >= longest.width:  # the last of equally wide lines
+                    longest = row
+                for word in row.words:
+                    symbol_widths.extend(word.symbol_widths)
+
+        profiler.count('lines', len(page_lines))
+        profiler.count('stat lines', len(lines))
+
+        if longest is None:
+            return lines, 0.
+        return lines, statistics.median(symbol_widths) / len(longest._text)
 
     @property
-    def lines(self) -> t.Generator[Line, None, None]:
-        yield from filter(ReportPage._is_stat_line, self.raw.lines)
+    def lines(self) -> t.Iterator[Line]:
+        return iter(self._stat_lines[0])
 
     @property
     def padded_lines(self) -> t.Generator[PaddedLine, None, None]:
-        char_width = self._char_width()
-        return (PaddedLine(line, char_width) for line in self.lines)
+        lines, char_width = self._stat_lines
+        return (PaddedLine(line, char_width) for line in lines)
 
     def _char_width(self) -> float:
-        lines = list(self.lines)
-        try:
-            longest: Line = list(sorted(lines, key=lambda l: l.width))[-1]
-        except IndexError:
-            return 0.
-        words = chain(*(line.words for line in lines))
-        symbols = chain(*(word.symbols for word in words))
-        char_width = statistics.median((symbol.width for symbol in symbols))
-        return char_width / len(longest._text)
+        return self._stat_lines[1]
 
 
 @dataclass(frozen=True, eq=True)
 class ReportFile:
     pdf_path: str
 
-    @property
+    @cached_property
     def _document(self) -> DocumentFile:
         return DocumentFile(self._json_path)
 
@@ -69,19 +104,25 @@ class ReportFile:
     def _pages(self) -> t.List[Page]:
         return self._document.pages
 
-    @property
+    @cached_property
     def pages(self) -> t.List[ReportPage]:
         return list(map(ReportPage, self._pages))
 
-    @property
+    def iter_pages(self) -> t.Iterator[ReportPage]:
+        """
+        streams pages from the OCR JSON, so each can be dropped before the next one is decoded
+        """
+        return map(ReportPage, self._document.iter_pages())
+
+    @cached_property
     def pdf_name(self) -> str:
         return basename(self.pdf_path)
 
-    @property
+    @cached_property
     def _base_name(self) -> str:
         return self.pdf_name.rsplit('.', 1)[0]
 
-    @property
+    @cached_property
     def _dates_raw(self):
         return self._base_name.split('-')
 
@@ -93,44 +134,181 @@ class ReportFile:
     def _date_raw_end(self):
         return self._dates_raw[1]
 
-    @property
+    @cached_property
     def start_date(self):
         return parse_date(self._date_raw_start)
 
-    @property
+    @cached_property
     def end_date(self):
         return parse_date(self._date_raw_end)
 
-    @property
+    @cached_property
     def _json_path(self) -> str:
         return f'./result/{self._base_name}.json'
 
-    def __repr__(self):
-        return f'<ReportFile: {self.pdf_path} ({len(self.pages)} pages)>'
-
-
-def main():
-    report_files = sorted(list(map(ReportFile, listdir(PDF_DIR))), key=lambda r: r.end_date)
-    # f = report_files[0]
-    # print(f)
-
-    response: t.List[t.Dict[str, t.Union[str, int, float]]] = []
-
-    for f in report_files:
-        print(f, end=' ')
-        lines: t.List[PaddedLine] = list(chain(*(page.padded_lines for page in f.pages)))
-        sicknesses = (SicknessEntry(line, f.start_date, f.end_date, f.pdf_path) for line in lines)
-
-        for sickness in sicknesses:
-            print('.', end='', flush=True)
-            response.append(sickness.json)
-
-        print('[OK]')
+    @property
+    def page_count(self) -> int:
+        """
+        taken from the parsed pages when there are some, otherwise peeked at without decoding the JSON
+        """
+        return self._document.page_count
 
-    with open('response.json', 'w') as f:
-        f.write(dumps(response, indent=2))
-        # break
+    def __repr__(self):
+        return f'<ReportFile: {self.pdf_path} ({self.page_count} pages)>'
+
+
+def scan_reports(directory: str = PDF_DIR) -> t.List[ReportFile]:
+    """
+    :return: reports downloaded to `directory` sorted by end date, read from file names only
+    """
+    with scandir(directory) as entries:
+        reports = [ReportFile(entry.name) for entry in entries if entry.name.endswith('.pdf') and entry.is_file()]
+    return sorted(reports, key=lambda r: r.end_date)
+
+
+def parse_report(pdf_path: str) -> t.List[Entry]:
+    """
+    runs in a worker process when `--jobs` > 1, hence plain dicts in and out.
+    Pages are streamed and turned into entries one by one, so a worker holds a single decoded page at a time.
+    """
+    report = ReportFile(pdf_path)
+    entries: t.List[Entry] = []
+    with profiler.stage('report', report.pdf_name):
+        with profiler.stage('decode'):  # opens, or first builds, the geometry sidecar
+            pages = report.iter_pages()
+        while True:
+            with profiler.stage('decode'):
+                page = next(pages, None)
+            if page is None:
+                break
+
+            lines = list(page.padded_lines)
+            with profiler.stage('entries'):
+                for line in lines:
+                    entries.append(SicknessEntry(line, report.start_date, report.end_date, report.pdf_path).json)
+            profiler.count('pages')
+        profiler.count('entries', len(entries))
+    return entries
+
+
+def _parse_report_profiled(pdf_path: str) -> t.Tuple[t.List[Entry], t.Any]:
+    """
+    `parse_report` handing what the profiler recorded back from a worker process
+    """
+    entries = parse_report(pdf_path)
+    return entries, profiler.drain()
+
+
+def _enable_profiler():
+    """
+    pool initializer: a module-level function, so under spawn a worker enables its own `profiler` instead of an
+    unpickled copy of the parent's
+    """
+    profiler.enable()
+
+
+def main(
+        jobs: int = 1,
+        output_format: str = DEFAULT_FORMAT,
+        out: t.Optional[str] = None,
+        rebuild: bool = False,
+        raw_names: bool = False,
+):
+    report_files = scan_reports(PDF_DIR)
+    out = out or f'response.{output_format}'
+
+    manifest = Manifest(MANIFEST_PATH, PARSER_VERSION) if rebuild else Manifest.load(MANIFEST_PATH, PARSER_VERSION)
+    cached = {f.pdf_path: manifest.entries(f.pdf_path, f._json_path) for f in report_files}
+    stale = [pdf_path for pdf_path, entries in cached.items() if entries is None]
+    # applied when writing, so the manifest keeps OCR names and alias changes need no reparse
+    names = NameCanonicalizer.load(ALIASES_PATH)
+
+    profiled = profiler.enabled
+    worker = _parse_report_profiled if profiled else parse_report
+
+    with WRITERS[output_format](out) as writer, \
+            ProcessPoolExecutor(jobs, initializer=_enable_profiler if profiled else None) \
+            if jobs > 1 else nullcontext() as executor:
+        parsed = executor.map(worker, stale) if executor else map(worker, stale)
+        # both maps yield in submission order, so entries stay sorted by end_date
+        for f in report_files:
+            print(f.pdf_name, end=' ')
+            entries = cached[f.pdf_path]
+            if entries is None:
+                entries = next(parsed)
+                if profiled:
+                    entries, recorded = entries
+                    profiler.merge(recorded)
+                manifest.update(f.pdf_path, f._json_path, entries)
+                status = '[OK]'
+            else:
+                status = '[CACHED]'
+
+            if not raw_names:
+                canonical = names.canonical_rows([entry['name'] for entry in entries])
+                entries = [
+                    {**entry, 'name': name, 'raw_name': entry['name']} for entry, name in zip(entries, canonical)
+                ]
+            for entry in entries:
+                print('.', end='', flush=True)
+                writer.write(entry)
+
+            writer.flush()
+            print(status)
+
+    manifest.save()
+    names.save(ALIASES_PATH)
+
+
+parser = argparse.ArgumentParser(description='Extracts sickness entries from annotated SANEPID™ reports.')
+
+parser.add_argument(
+    '--jobs',
+    type=int,
+    default=1,
+    help='number of worker processes parsing reports, defaults to 1 (no pool)'
+)
+
+parser.add_argument(
+    '--format',
+    type=str,
+    choices=list(WRITERS),
+    default=DEFAULT_FORMAT,
+    help=f'output format, defaults to {DEFAULT_FORMAT}; columns writes a directory of .npy arrays'
+)
+
+parser.add_argument('--out', type=str, required=False, help='output file, defaults to response.<format>')
+
+parser.add_argument(
+    '--rebuild',
+    action='store_true',
+    help=f'reparse every report instead of reusing unchanged ones recorded in {MANIFEST_PATH}'
+)
+
+parser.add_argument(
+    '--raw-names',
+    action='store_true',
+    help=f'keep sickness names as read by OCR instead of mapping them to canonical ones through {ALIASES_PATH}'
+)
+
+parser.add_argument(
+    '--profile',
+    type=str,
+    nargs='?',
+    const='1',
+    default=environ.get(PROFILE_ENV),
+    metavar='OUT',
+    help=f'print time, counts and peak memory per stage and report; OUT ending with .pstats or .prof also gets '
+         f'cProfile stats, any other OUT a Chrome trace. Defaults to ${PROFILE_ENV}'
+)
+
+
+def cli(argv: t.Optional[t.List[str]] = None):
+    args = parser.parse_args(argv)
+    profile = profile_output(args.profile)
+    with profiling(profile) if profile is not None else nullcontext():
+        main(jobs=args.jobs, output_format=args.format, out=args.out, rebuild=args.rebuild, raw_names=args.raw_names)
 
 
 if __name__ == '__main__':
-    main()
+    cli()
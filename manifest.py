@@ -0,0 +1,81 @@
+import typing as t
+import os
+import hashlib
+from json import loads, dumps
+
+from writers import Entry
+
+MANIFEST_PATH = './manifest.json'
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    remembers, per report, the OCR file it was parsed from and the entries it produced.
+
+    A report is reused when its source has the same mtime and size, or - if only the mtime changed -
+    the same content hash. Everything is invalidated when `parser_version` changes.
+    """
+    def __init__(self, path: str, parser_version: int):
+        self.path = path
+        self.parser_version = parser_version
+        self._previous: t.Dict[str, t.Dict[str, t.Any]] = {}
+        self._current: t.Dict[str, t.Dict[str, t.Any]] = {}
+
+    @classmethod
+    def load(cls, path: str, parser_version: int) -> 'Manifest':
+        manifest = cls(path, parser_version)
+        try:
+            with open(path) as f:
+                data = loads(f.read())
+        except FileNotFoundError:
+            return manifest
+
+        if data.get('parser_version') == parser_version:
+            manifest._previous = data['reports']
+        return manifest
+
+    def entries(self, key: str, source_path: str) -> t.Optional[t.List[Entry]]:
+        """
+        :return: cached entries when `source_path` did not change since `key` was recorded, None otherwise
+        """
+        record = self._previous.get(key)
+        if record is None:
+            return None
+
+        stat = os.stat(source_path)
+        if (record['mtime'], record['size']) != (stat.st_mtime_ns, stat.st_size):
+            if record['size'] != stat.st_size or record['sha1'] != file_hash(source_path):
+                return None
+            record = {**record, 'mtime': stat.st_mtime_ns}
+
+        self._current[key] = record
+        return record['entries']
+
+    def update(self, key: str, source_path: str, entries: t.List[Entry]):
+        stat = os.stat(source_path)
+        self._current[key] = {
+            'source': source_path,
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'sha1': file_hash(source_path),
+            'entries': entries,
+        }
+
+    def save(self):
+        """
+        keeps only the reports seen in this run; written to a temporary file first so an interrupted run
+        cannot leave a truncated manifest behind
+        """
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(dumps({'parser_version': self.parser_version, 'reports': self._current}))
+        os.replace(tmp_path, self.path)
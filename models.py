@@ -18,6 +18,23 @@ WEIRD_CHARACTERS_MAPPING = {
 VALID_NUMBER_CHARACTERS = digits + '.'
 
 
+class ParsingException(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Sickness:
+    """
+    a row of the tabula-extracted report table
+    """
+    index: int
+    name: t.Optional[str]
+    subcategory: str
+    values: t.Tuple[float, ...]
+    this_year: str
+    last_year: str
+
+
 def normalize_number(number: str) -> str:
     for k, v in WEIRD_CHARACTERS_MAPPING.items():
         number = number.replace(k, v)
@@ -79,5 +96,7 @@ class SicknessEntry:
         return {
             'name': self.name,
             'per_30_days': self.value_per_30_days,
-            'measured': self.end_date.isoformat()
+            'started': self.start_date.isoformat(),
+            'measured': self.end_date.isoformat(),
+            'values': list(self.values),
         }
@@ -0,0 +1,145 @@
+import typing as t
+import os
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from json import loads, dumps
+
+ALIASES_PATH = './aliases.json'
+SIMILARITY_THRESHOLD = 0.85
+NGRAM = 3
+# letters NFKD does not decompose into a base letter and a diacritic
+EXTRA_TRANSLATION = str.maketrans({'ł': 'l', 'Ł': 'L'})
+NON_ALPHANUMERIC = re.compile(r'[\W_]+')
+ROW_INDEX = re.compile(r'^\s*\d+\s+')
+
+
+def strip_index(raw: str) -> str:
+    """
+    drops the row number OCR reads in front of a name: '12 Odra' -> 'Odra'
+    """
+    return ROW_INDEX.sub('', raw, count=1)
+
+
+def _fold(raw: str) -> str:
+    decomposed = unicodedata.normalize('NFKD', raw.translate(EXTRA_TRANSLATION))
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+
+
+def name_key(raw: str) -> str:
+    """
+    OCR-insensitive form of a name: no diacritics, case, hyphens, punctuation or spaces - so split words
+    and 'zakaże-nie' / 'zakazenie' end up the same
+    """
+    return NON_ALPHANUMERIC.sub('', _fold(raw))
+
+
+def markers(raw: str) -> t.FrozenSet[str]:
+    """
+    single letters and numbers of a name - 'typu B', 'do lat 14' - which tell apart sicknesses whose names
+    are otherwise the same, so names with different ones are never merged by similarity
+    """
+    return frozenset(token for token in NON_ALPHANUMERIC.split(_fold(raw)) if len(token) == 1 or token.isdigit())
+
+
+def ngrams(key: str) -> t.Set[str]:
+    padded = f' {key} '
+    return {padded[i:i + NGRAM] for i in range(max(len(padded) - NGRAM + 1, 1))}
+
+
+class NameCanonicalizer:
+    """
+    Maps raw OCR sickness names to canonical ones.
+
+    `aliases` (raw -> canonical) is both the persistent table and the memo: a raw string is resolved once.
+    New names lose their OCR row number and are matched by their `name_key`, then by n-gram similarity (Dice
+    coefficient) against known canonical names with the same `markers`, found through an inverted n-gram index;
+    below `threshold` a name becomes canonical itself.
+
+    Generic subrows - 'razem', 'ogółem', 'inne określone' - repeat within a report under different sicknesses,
+    so `canonical_rows` keeps the row number of every name that is not unique in a report.
+    """
+    def __init__(self, aliases: t.Optional[t.Dict[str, str]] = None, threshold: float = SIMILARITY_THRESHOLD):
+        self.aliases: t.Dict[str, str] = {}
+        self.threshold = threshold
+        self._by_key: t.Dict[str, str] = {}
+        self._ngrams: t.Dict[str, t.Set[str]] = {}
+        self._markers: t.Dict[str, t.FrozenSet[str]] = {}
+        self._index: t.Dict[str, t.Set[str]] = defaultdict(set)
+        self._generic: t.Set[str] = set()
+
+        for raw, canonical in (aliases or {}).items():
+            self._add_canonical(canonical)
+            self.aliases[raw] = canonical
+
+    @classmethod
+    def load(cls, path: str = ALIASES_PATH, threshold: float = SIMILARITY_THRESHOLD) -> 'NameCanonicalizer':
+        try:
+            with open(path) as f:
+                return cls(loads(f.read()), threshold)
+        except FileNotFoundError:
+            return cls(threshold=threshold)
+
+    def save(self, path: str = ALIASES_PATH):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(dumps(self.aliases, indent=2, ensure_ascii=False, sort_keys=True))
+        os.replace(tmp_path, path)
+
+    def _add_canonical(self, canonical: str):
+        key = name_key(canonical)
+        if key in self._by_key:
+            return
+
+        self._by_key[key] = canonical
+        self._markers[canonical] = markers(canonical)
+        grams = self._ngrams[canonical] = ngrams(key)
+        for gram in grams:
+            self._index[gram].add(canonical)
+
+    def _closest(self, name: str, key: str) -> t.Optional[str]:
+        grams = ngrams(key)
+        name_markers = markers(name)
+        shared = Counter(canonical for gram in grams for canonical in self._index.get(gram, ()))
+        best, best_score = None, self.threshold
+        for canonical, count in shared.items():
+            if self._markers[canonical] != name_markers:
+                continue
+            score = 2 * count / (len(grams) + len(self._ngrams[canonical]))
+            if score >= best_score:
+                best, best_score = canonical, score
+        return best
+
+    def canonical(self, raw: str) -> str:
+        try:
+            return self.aliases[raw]
+        except KeyError:
+            pass
+
+        name = strip_index(raw)
+        key = name_key(name)
+        canonical = self._by_key.get(key) or self._closest(name, key)
+        if canonical is None:
+            canonical = name
+            self._add_canonical(name)
+
+        self.aliases[raw] = canonical
+        return canonical
+
+    def canonical_rows(self, raws: t.Sequence[str]) -> t.List[str]:
+        """
+        :param raws: raw names of all rows of one report
+        :return: their canonical names, with the row number kept for names shared by several rows of a report
+            (in this one or an earlier one), so distinct rows never end up with the same name
+        """
+        names = [self.canonical(raw) for raw in raws]
+        self._generic.update(name for name, count in Counter(names).items() if count > 1)
+        return [_numbered(raw, name) if name in self._generic else name for raw, name in zip(raws, names)]
+
+
+def _numbered(raw: str, canonical: str) -> str:
+    """
+    '4 rażem', 'razem' -> '4 razem'; without a row number there is nothing to tell the row apart by but `raw`
+    """
+    index = ROW_INDEX.match(raw)
+    return f'{index.group().strip()} {canonical}' if index else raw
@@ -3,20 +3,29 @@ import typing as t
 import os
 import csv
 import argparse
+import threading
+from queue import Queue
 from itertools import chain
+from datetime import datetime
 import warnings
 warnings.filterwarnings("ignore")
 from pprint import pprint
 
-import tabula
+import numpy as np
 
+from columnar import DictionaryColumn, save_columns, padded_matrix
 from helpers import stripped
 from models import Sickness, ParsingException
-from downloader import all_pdfs
+from downloader import all_pdfs, Downloader
+from visionary import parse_date
 
 NORMALIZED_LINE_LENGTH = 3
 OUTPUT_DIRECTORY = 'result/'
 DEFAULT_OUTPUT = 'csv'
+OUTPUT_FORMATS = ['csv', 'columns']
+DOWNLOADERS = 4
+EXTRACTORS = 1  # tabula-java runs in this process, more threads mostly contend for the same JVM
+QUEUE_SIZE = 8
 WEIRD_HYPHEN = '–'
 NULL_VALUES = [
     WEIRD_HYPHEN,
@@ -31,22 +40,26 @@ parser = argparse.ArgumentParser(
 )
 
 parser.add_argument(
-    '--source',
+    '--format',
     type=str,
-    required=False,
-    help='HTTP link or local path to a file converted. By default all files are downloaded.'
+    choices=OUTPUT_FORMATS,
+    default=DEFAULT_OUTPUT,
+    help=f'output format, defaults to {DEFAULT_OUTPUT}; columns writes a directory of .npy arrays per report'
 )
 
-parser.add_argument('--format', type=str, default=DEFAULT_OUTPUT, help=f'output format, defaults to {DEFAULT_OUTPUT}')
-
 parser.add_argument(
-    '--out',
-    type=str,
-    required=False,
-    help='name of output file, defaults to source name with .csv extension'
+    '--downloaders',
+    type=int,
+    default=DOWNLOADERS,
+    help=f'number of concurrent downloads, defaults to {DOWNLOADERS}'
 )
 
-args = parser.parse_args()
+parser.add_argument(
+    '--extractors',
+    type=int,
+    default=EXTRACTORS,
+    help=f'number of threads extracting tables, defaults to {EXTRACTORS}'
+)
 
 
 def starts_with_index(word: str) -> bool:
@@ -81,39 +94,62 @@ def get_valid_lines(lines: t.List[t.List[str]]) -> t.Generator[t.List[str], None
         yield line
 
 
+def _normalized_character(ch: str) -> str:
+    for null_value in NULL_VALUES:
+        ch = ch.replace(null_value, '0.0')
+    return ch.replace(',', '.')
+
+
+# same result as replacing every NULL_VALUES entry with '0.0' and then ',' with '.', in a single pass
+CELL_TRANSLATION = str.maketrans({ch: _normalized_character(ch) for ch in [*NULL_VALUES, ',']})
+
+
+def _continues_number(token: str) -> bool:
+    """
+    thousands are printed with a space - '1 272', '2 372.77' - so such a token belongs to the previous one
+    """
+    return len(token) == 3 or ('.' in token and len(token) == 6)
+
+
+def _join_weird_spacing(tokens: t.List[str]) -> str:
+    pieces = []
+    for token, nextval in zip(tokens, tokens[1:]):
+        pieces.append(token)
+        if not _continues_number(nextval):
+            pieces.append(' ')
+    pieces.extend(tokens[-1:])
+    return ''.join(pieces)
+
+
 def reformat_weird_spacing(values: str) -> str:
-    parsed = ''
-    values = values.split()
-    for i, element in enumerate(values):
-        parsed += element
-        nextval = values[i + 1] if values[i + 1:] else None
-        if nextval:
-            if len(nextval) == 3 or ('.' in nextval and len(nextval) == 6):
-                pass
-            else:
-                parsed += ' '
+    return _join_weird_spacing(values.split())
+
 
-    return parsed
+def _split_weird_spacing(tokens: t.List[str]) -> t.Sequence[str]:
+    parsed = _join_weird_spacing(tokens)
+    numbers = parsed.split()
+
+    if len(numbers) != 2:
+        return parsed[:-6], parsed[-6:]
+
+    return numbers
 
 
 def fix_werid_spacing(values: str) -> t.Tuple[str, str]:
-    parsed = reformat_weird_spacing(values)
+    return tuple(_split_weird_spacing(values.split()))
 
-    if len(parsed.split()) != 2:
-        return parsed[:-6], parsed[-6:]
 
-    return tuple(parsed.split())
+def parse_cell(cell: str) -> t.List[float]:
+    """
+    a raw tabula cell holds two numbers (count and incidence), possibly with null markers, decimal commas
+    and thousands separated by spaces
+    """
+    tokens = cell.translate(CELL_TRANSLATION).split()
+    return [float(value) for value in (tokens if len(tokens) == 2 else _split_weird_spacing(tokens))]
 
 
 def parse_values(values: t.List[str]) -> t.List[float]:
-    parsed = values[:]
-    for null_value in NULL_VALUES:
-        parsed: t.List[str] = [piece.replace(null_value, '0.0') for piece in parsed]
-    parsed = [piece.replace(',', '.') for piece in parsed]
-    parsed = [fix_werid_spacing(piece) if len(piece.split()) != 2 else piece.split() for piece in parsed]
-    parsed: t.List[float] = [float(value) for piece in parsed for value in piece]
-
-    return parsed
+    return [value for cell in values for value in parse_cell(cell)]
 
 
 def parse_line(line: t.List[str]) -> t.Tuple[int, str, t.Tuple[float]]:
@@ -130,13 +166,29 @@ def skip(iterable: t.Iterator, times: int) -> t.Iterator:
     return iterable
 
 
-def load_sicknesses(filename: str) -> t.Generator[Sickness, None, None]:
-    tmpfile = filename.rsplit('/')[-1] + '.tmp'
-    tabula.convert_into(filename, tmpfile, output_format=format_, pages='all', silent=True)
+class TableExtractor:
+    """
+    Reads pdf tables straight into memory. tabula-py keeps tabula-java running in-process (jpype) once the
+    first file is read, so a single extractor serves every report of a session without JVM restarts.
+    """
+    def rows(self, filename: str) -> t.List[t.List[str]]:
+        # without jpype tabula-py only logs a warning and starts a JVM subprocess for every pdf instead
+        import jpype  # noqa: F401
+        import tabula  # pulls in pandas, so only when a table is read
+
+        tables = tabula.read_pdf(filename, output_format='json', pages='all', silent=True, force_subprocess=False)
+        return [[cell['text'] for cell in row] for table in tables for row in table['data']]
+
 
-    with open(tmpfile) as file:
-        lines = stripped(csv.reader(file, delimiter=','))
-    os.remove(tmpfile)
+def load_sicknesses(filename: str, extractor: t.Optional[TableExtractor] = None) -> t.Generator[Sickness, None, None]:
+    return sicknesses_from_rows((extractor or TableExtractor()).rows(filename))
+
+
+def sicknesses_from_rows(rows: t.Iterable[t.Iterable[str]]) -> t.Generator[Sickness, None, None]:
+    """
+    :param rows: raw table rows as tabula reads them - the years header, two more header rows, then sicknesses
+    """
+    lines = stripped(rows)
 
     this_year, last_year = lines[0]
     valid_lines = get_valid_lines(lines[3:])
@@ -168,22 +220,108 @@ def write_to_csv(filename: str, sicknesses: t.Generator[Sickness, None, None]):
             )
 
 
-def main():
+def write_to_columns(directory: str, sicknesses: t.Iterator[Sickness], measured: datetime):
+    """
+    memory-mappable .npy columns, see `columnar.load_columns`; `values` rows shorter than the longest are NaN-padded
+    """
+    sicknesses = list(sicknesses)
+    save_columns(directory, {
+        'index': np.array([sickness.index for sickness in sicknesses], dtype=np.int32),
+        'name': DictionaryColumn.encode(sickness.name for sickness in sicknesses),
+        'subcategory': DictionaryColumn.encode(sickness.subcategory for sickness in sicknesses),
+        'measured': np.full(len(sicknesses), np.datetime64(measured.date(), 'D')),
+        'values': padded_matrix([sickness.values for sickness in sicknesses]),
+    })
+
+
+_DONE = object()
+
+
+def run_stage(
+        func: t.Callable[[str, t.Any], t.Any],
+        inbox: Queue,
+        outbox: Queue,
+        workers: int,
+) -> t.List[threading.Thread]:
+    """
+    Starts `workers` threads moving `(date, payload)` items from `inbox` to `outbox` through `func(date, payload)`.
+
+    Both queues are bounded, so a slow stage blocks the ones before it. A failure is passed downstream in
+    place of the payload instead of stopping the stage. `outbox` gets `_DONE` after the last worker exits.
+    """
+    remaining = [workers]
+    lock = threading.Lock()
+
+    def _work():
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                inbox.put(_DONE)  # wake up the other workers of this stage
+                break
+
+            date, payload = item
+            try:
+                outbox.put((date, payload if isinstance(payload, Exception) else func(date, payload)))
+            except Exception as e:
+                outbox.put((date, e))
+
+        with lock:
+            remaining[0] -= 1
+            if not remaining[0]:
+                outbox.put(_DONE)
+
+    threads = [threading.Thread(target=_work, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def main(downloaders: int = DOWNLOADERS, extractors: int = EXTRACTORS, output_format: str = DEFAULT_OUTPUT):
+    """
+    download -> extract -> write, with `downloaders` fetching and `extractors` reading tables concurrently
+    while this thread writes finished reports
+    """
     current_files = os.listdir(OUTPUT_DIRECTORY)
-
-    for date, link in all_pdfs():
-        filename = f'{date}.csv'
-        print(f'{date}... ', end='')
-        if filename not in current_files:
-            write_to_csv(f'{OUTPUT_DIRECTORY}{filename}', load_sicknesses(link))
-            print('DONE')
+    downloader = Downloader(concurrency=downloaders)
+    extractor = TableExtractor()
+    links, downloaded, extracted = Queue(QUEUE_SIZE), Queue(QUEUE_SIZE), Queue(QUEUE_SIZE)
+
+    def _download(date: str, link: str) -> str:
+        downloader.fetch(date, link)
+        return os.path.join(downloader.directory, f'{date}.pdf')
+
+    def _extract(date: str, path: str) -> t.List[Sickness]:
+        return list(load_sicknesses(path, extractor))
+
+    def _feed():
+        try:
+            for date, link in all_pdfs(downloader.session):
+                if f'{date}.{output_format}' in current_files:
+                    print(f'{date}... ALREADY EXISTS')
+                else:
+                    links.put((date, link))
+        finally:
+            links.put(_DONE)
+
+    threading.Thread(target=_feed, daemon=True).start()
+    run_stage(_download, links, downloaded, downloaders)
+    run_stage(_extract, downloaded, extracted, extractors)
+
+    for date, sicknesses in iter(extracted.get, _DONE):
+        if isinstance(sicknesses, Exception):
+            print(f'{date}... FAILED ({sicknesses!r})')
+        elif output_format == 'columns':
+            write_to_columns(f'{OUTPUT_DIRECTORY}{date}.columns', iter(sicknesses), parse_date(date.split('-')[1]))
+            print(f'{date}... DONE')
         else:
-            print('ALREADY EXISTS')
+            write_to_csv(f'{OUTPUT_DIRECTORY}{date}.csv', iter(sicknesses))
+            print(f'{date}... DONE')
 
 
-if __name__ == '__main__':
-    format_ = args.format
-    sources = [args.source] if args.source else ['test_data/INF_18_10B.pdf']
-    outs = [args.out] if args.out else [o[:-3] + format_ for o in sources]
+def cli(argv: t.Optional[t.List[str]] = None):
+    args = parser.parse_args(argv)
+    main(args.downloaders, args.extractors, args.format)
+
 
-    main()
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,142 @@
+"""
+Turns overlapping reports into a series of non-overlapping periods.
+
+Reports of one year overlap - e.g. 1.01-15.01, 1.01-31.03 and 1.01-31.12 are all cumulative from January,
+next to half-month and quarterly ones. Each report says that the count accumulated between the day before
+its start and its end date grew by its value: `C(end) - C(start - 1) = value`. Walking these constraints
+from the earliest date of a year assigns `C` to every date reachable through reports, and differences of
+`C` between consecutive dates are the increments of the periods in between. Sicknesses are walked over
+the reports that list them, so one missing from a report gets the longer period around it; everything is
+done on vectors of all sicknesses listed by the same reports at once.
+"""
+import typing as t
+from collections import defaultdict, deque
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from writers import Entry
+
+ReportKey = t.Tuple[date, date]
+Edge = t.Tuple[date, np.ndarray]
+
+
+def _day(iso: str) -> date:
+    return datetime.fromisoformat(iso).date()
+
+
+def _iso(day: date) -> str:
+    """
+    same format as `SicknessEntry.json` dates
+    """
+    return datetime(day.year, day.month, day.day).isoformat()
+
+
+def _reports(entries: t.Iterable[Entry]) -> t.Tuple[t.List[str], t.Dict[ReportKey, np.ndarray]]:
+    """
+    :return: sickness names and, per (start, end) report, the value of every sickness (NaN when missing)
+    """
+    name_index: t.Dict[str, int] = {}
+    values: t.Dict[ReportKey, t.Dict[int, float]] = defaultdict(dict)
+    for entry in entries:
+        report = _day(entry['started']), _day(entry['measured'])
+        values[report][name_index.setdefault(entry['name'], len(name_index))] = entry['values'][0]
+
+    vectors = {}
+    for report, by_name in values.items():
+        vector = vectors[report] = np.full(len(name_index), np.nan)
+        vector[list(by_name)] = list(by_name.values())
+    return list(name_index), vectors
+
+
+def _potentials(reports: t.Dict[ReportKey, np.ndarray]) -> t.List[t.Dict[date, np.ndarray]]:
+    """
+    :return: for every group of dates connected by reports, the cumulative count `C` at each date
+    """
+    edges: t.Dict[date, t.List[Edge]] = defaultdict(list)
+    # shorter reports first, so a period is taken from a direct report rather than a difference when possible
+    for (start, end), vector in sorted(reports.items(), key=lambda r: (r[0][1] - r[0][0], r[0])):
+        before = start - timedelta(days=1)
+        edges[before].append((end, vector))
+        edges[end].append((before, -vector))
+
+    size = len(next(iter(reports.values())))
+    components = []
+    assigned: t.Set[date] = set()
+    for root in sorted(edges):
+        if root in assigned:
+            continue
+
+        component = {root: np.zeros(size)}
+        assigned.add(root)
+        queue = deque([root])
+        while queue:
+            node = queue.popleft()
+            for neighbour, delta in edges[node]:
+                if neighbour not in assigned:
+                    assigned.add(neighbour)
+                    component[neighbour] = component[node] + delta
+                    queue.append(neighbour)
+        components.append(component)
+
+    return components
+
+
+def _increments(reports: t.Dict[ReportKey, np.ndarray]) -> t.Iterator[t.Tuple[date, date, np.ndarray]]:
+    """
+    :return: (day before, end, values) of the non-overlapping periods of reports of one year, ordered by date
+    """
+    increments = []
+    for component in _potentials(reports):
+        dates = sorted(component)
+        for before, end in zip(dates, dates[1:]):
+            increments.append((before, end, component[end] - component[before]))
+
+    covered_until = date.min
+    for before, end, vector in sorted(increments, key=lambda i: (i[0], i[1])):
+        if before < covered_until:
+            continue  # overlaps a period of another, unconnected group of reports
+        covered_until = end
+        yield before, end, vector
+
+
+def normalize_periods(entries: t.Iterable[Entry]) -> t.Iterator[Entry]:
+    """
+    :param entries: `SicknessEntry.json` dicts of any set of reports
+    :return: one entry per sickness and non-overlapping period, ordered by date. `value` is the count in
+        (started - 1, measured] and `per_30_days` scales it by the period's length in days.
+        Periods not covered by any chain of reports listing a sickness are left out for that sickness.
+    """
+    names, reports = _reports(entries)
+    by_year: t.Dict[int, t.Dict[ReportKey, np.ndarray]] = defaultdict(dict)
+    for (start, end), vector in reports.items():
+        by_year[end.year][start, end] = vector
+
+    for year in sorted(by_year):
+        keys = list(by_year[year])
+        matrix = np.stack([by_year[year][key] for key in keys])
+        listed = ~np.isnan(matrix)
+
+        # sicknesses listed by the same reports share their periods
+        groups: t.Dict[bytes, t.List[int]] = defaultdict(list)
+        for i in range(len(names)):
+            groups[listed[:, i].tobytes()].append(i)
+
+        periods = []
+        for columns in groups.values():
+            rows = np.flatnonzero(listed[:, columns[0]])
+            if not len(rows):
+                continue
+            group_reports = {keys[row]: matrix[row, columns] for row in rows}
+            for before, end, vector in _increments(group_reports):
+                periods.extend((before, end, i, value) for i, value in zip(columns, vector))
+
+        for before, end, i, value in sorted(periods, key=lambda p: p[:3]):
+            days = (end - before).days
+            yield {
+                'name': names[i],
+                'value': float(value),
+                'per_30_days': float(value) * 30 / days,
+                'started': _iso(before + timedelta(days=1)),
+                'measured': _iso(end),
+            }
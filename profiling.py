@@ -0,0 +1,211 @@
+"""
+Opt-in instrumentation of the parse pipeline.
+
+Code marks its stages with `profiler.stage(name)` and counts objects with `profiler.count(name, n)`. Both do
+nothing until profiling is enabled - with `main.py --profile` or the INFESTATION_PROFILE environment
+variable - so they are cheap enough to leave around every page. When enabled, every stage records its wall
+time and the peak of memory traced by `tracemalloc` while it ran, attributed to the report it belongs to.
+"""
+import typing as t
+import cProfile
+import os
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from json import dumps
+
+PROFILE_ENV = 'INFESTATION_PROFILE'
+PSTATS_EXTENSIONS = ('.pstats', '.prof')
+SLOWEST_REPORTS = 10
+MB = 1 << 20
+
+Counts = t.Dict[t.Tuple[t.Optional[str], str], int]
+
+
+class Event(t.NamedTuple):
+    stage: str
+    report: t.Optional[str]
+    start: int  # time.perf_counter_ns(), comparable between processes of one machine
+    duration: int  # ns
+    peak: int  # bytes traced at the highest point of the stage
+    pid: int
+
+
+class _NullStage:
+    def __enter__(self) -> '_NullStage':
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ('profiler', 'name', 'report', 'start', 'child_peak')
+
+    def __init__(self, profiler: 'Profiler', name: str, report: t.Optional[str]):
+        self.profiler = profiler
+        self.name = name
+        self.report = report
+
+    def __enter__(self) -> '_Stage':
+        stack = self.profiler._stack
+        if stack:
+            # the tracemalloc peak is reset below, so the enclosing stage keeps what it has reached so far
+            stack[-1].child_peak = max(stack[-1].child_peak, tracemalloc.get_traced_memory()[1])
+        stack.append(self)
+        self.child_peak = 0
+        tracemalloc.reset_peak()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter_ns() - self.start
+        peak = max(tracemalloc.get_traced_memory()[1], self.child_peak)
+        stack = self.profiler._stack
+        stack.pop()
+        if stack:
+            stack[-1].child_peak = max(stack[-1].child_peak, peak)
+        self.profiler.events.append(Event(self.name, self.report, self.start, duration, peak, os.getpid()))
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.events: t.List[Event] = []
+        self.counts: Counts = defaultdict(int)
+        self._stack: t.List[_Stage] = []
+
+    def enable(self):
+        self.enabled = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        self.enabled = False
+        tracemalloc.stop()
+
+    @property
+    def _report(self) -> t.Optional[str]:
+        return self._stack[-1].report if self._stack else None
+
+    def stage(self, name: str, report: t.Optional[str] = None) -> t.ContextManager:
+        """
+        times the block as stage `name` of `report`, by default the report of the enclosing stage
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, report or self._report)
+
+    def count(self, name: str, n: int = 1):
+        if self.enabled:
+            self.counts[self._report, name] += n
+
+    def drain(self) -> t.Tuple[t.List[Event], Counts]:
+        """
+        :return: and forgets everything recorded so far - how worker processes hand their records back
+        """
+        recorded = self.events, dict(self.counts)
+        self.events, self.counts = [], defaultdict(int)
+        return recorded
+
+    def merge(self, recorded: t.Tuple[t.List[Event], Counts]):
+        events, counts = recorded
+        self.events.extend(events)
+        for key, n in counts.items():
+            self.counts[key] += n
+
+    def summary(self) -> str:
+        stages: t.Dict[str, t.List[Event]] = defaultdict(list)
+        reports: t.Dict[str, t.List[Event]] = defaultdict(list)
+        for event in self.events:
+            stages[event.stage].append(event)
+            if event.report is not None:
+                reports[event.report].append(event)
+
+        rows = [f'{"stage":<16}{"calls":>8}{"total s":>10}{"mean ms":>10}{"peak MB":>10}']
+        for stage, events in stages.items():
+            total = sum(event.duration for event in events)
+            mean = total / len(events)
+            peak = max(event.peak for event in events)
+            rows.append(f'{stage:<16}{len(events):>8}{total / 1e9:>10.3f}{mean / 1e6:>10.2f}{peak / MB:>10.1f}')
+
+        totals: t.Dict[str, int] = defaultdict(int)
+        for (report, name), n in self.counts.items():
+            totals[name] += n
+        rows.append('')
+        rows.extend(f'{name:<16}{n:>8}' for name, n in totals.items())
+
+        def wall_time(report_events: t.List[Event]) -> int:
+            return max(e.start + e.duration for e in report_events) - min(e.start for e in report_events)
+
+        slowest = sorted(reports.items(), key=lambda r: wall_time(r[1]), reverse=True)[:SLOWEST_REPORTS]
+        if slowest:
+            rows.append('')
+            rows.append(f'{"slowest reports":<32}{"s":>8}{"entries":>10}{"peak MB":>10}')
+        for report, events in slowest:
+            entries = self.counts.get((report, 'entries'), 0)
+            peak = max(event.peak for event in events)
+            rows.append(f'{report:<32}{wall_time(events) / 1e9:>8.3f}{entries:>10}{peak / MB:>10.1f}')
+        return '\n'.join(rows)
+
+    def chrome_trace(self) -> t.Dict[str, t.Any]:
+        """
+        :return: Trace Event Format document, for chrome://tracing or https://ui.perfetto.dev
+        """
+        return {
+            'traceEvents': [
+                {
+                    'name': event.stage,
+                    'cat': 'parse',
+                    'ph': 'X',
+                    'ts': event.start / 1e3,
+                    'dur': event.duration / 1e3,
+                    'pid': event.pid,
+                    'tid': event.pid,
+                    'args': {'report': event.report, 'peak_bytes': event.peak},
+                }
+                for event in self.events
+            ],
+            'displayTimeUnit': 'ms',
+        }
+
+
+profiler = Profiler()
+
+
+def profile_output(value: t.Optional[str]) -> t.Optional[str]:
+    """
+    :param value: of `--profile` or INFESTATION_PROFILE - unset, empty or '0' disables profiling, '1' only
+        prints the summary and anything else is a file to dump to as well
+    :return: None when disabled, the dump path or ''
+    """
+    if value is None or value in ('', '0'):
+        return None
+    return '' if value == '1' else value
+
+
+@contextmanager
+def profiling(output: str = ''):
+    """
+    enables `profiler` for the block and prints its summary afterwards; `output` ending with .pstats or .prof
+    also gets cProfile stats of this process, any other non-empty one a Chrome trace of all processes
+    """
+    profiler.enable()
+    stats = cProfile.Profile() if output.endswith(PSTATS_EXTENSIONS) else None
+    if stats:
+        stats.enable()
+    try:
+        yield profiler
+    finally:
+        if stats:
+            stats.disable()
+            stats.dump_stats(output)
+        elif output:
+            with open(output, 'w') as f:
+                f.write(dumps(profiler.chrome_trace()))
+        profiler.disable()
+        print(profiler.summary())
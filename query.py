@@ -0,0 +1,124 @@
+import typing as t
+import argparse
+
+import numpy as np
+
+from group_json import STORE_PATH
+from store import SicknessStore, DateLike
+
+AGGREGATES: t.Dict[str, t.Callable[..., np.ndarray]] = {
+    'mean': np.nanmean,
+    'sum': np.nansum,
+    'max': np.nanmax,
+}
+DEFAULT_TOP = 10
+
+
+def _year_bounds(year: int) -> t.Tuple[str, str]:
+    return f'{year}-01-01', f'{year}-12-31T23:59:59'
+
+
+class SicknessQuery:
+    """
+    Answers questions about a `SicknessStore` without scanning it: sicknesses are found through the name
+    index, date ranges by binary search, and sums come from the store's per-sickness prefix sums.
+    """
+    def __init__(self, store: SicknessStore):
+        self.store = store
+
+    @classmethod
+    def load(cls, path: str = STORE_PATH) -> 'SicknessQuery':
+        return cls(SicknessStore.load(path))
+
+    def between(
+            self,
+            name: str,
+            start: t.Optional[DateLike] = None,
+            end: t.Optional[DateLike] = None,
+    ) -> t.List[t.Tuple[str, float]]:
+        """
+        :return: (measured, value) of sickness `name` within [start, end]
+        """
+        dates, values = self.store.series(name, start, end)
+        return list(zip(np.datetime_as_string(dates, unit='D'), values.tolist()))
+
+    def total(self, name: str, start: t.Optional[DateLike] = None, end: t.Optional[DateLike] = None) -> float:
+        rows = self.store.rows(start, end)
+        sums = self.store.sums[self.store.name_index[name]]
+        return float(sums[rows.stop] - sums[rows.start])
+
+    def rolling_sum(
+            self,
+            name: str,
+            days: int,
+            start: t.Optional[DateLike] = None,
+            end: t.Optional[DateLike] = None,
+    ) -> t.List[t.Tuple[str, float]]:
+        """
+        :return: for every date within [start, end], the sum of values measured in the `days` days up to it
+        """
+        rows = self.store.rows(start, end)
+        dates = self.store.dates
+        sums = self.store.sums[self.store.name_index[name]]
+
+        ends = np.arange(rows.start, rows.stop)
+        starts = np.searchsorted(dates, dates[ends] - np.timedelta64(days, 'D'), side='right')
+        totals = sums[ends + 1] - sums[starts]
+        return list(zip(np.datetime_as_string(dates[ends], unit='D'), totals.tolist()))
+
+    def top(self, year: int, n: int = DEFAULT_TOP, aggregate: str = 'mean') -> t.List[t.Tuple[str, float]]:
+        """
+        :return: `n` sicknesses with the highest aggregated value in `year`, highest first
+        """
+        rows = self.store.rows(*_year_bounds(year))
+        values = self.store.values[:, rows]
+        reported = ~np.isnan(values).all(axis=1)
+        names, values = self.store.names[reported], values[reported]
+        if not len(names):
+            return []
+
+        scores = AGGREGATES[aggregate](values, axis=1)
+        n = min(n, len(scores))
+        best = np.argpartition(-scores, n - 1)[:n]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(str(names[i]), float(scores[i])) for i in best]
+
+
+parser = argparse.ArgumentParser(description='Queries sicknesses grouped by group_json.py.')
+parser.add_argument('--store', type=str, default=STORE_PATH, help=f'store to query, defaults to {STORE_PATH}')
+commands = parser.add_subparsers(dest='command', required=True)
+
+between_parser = commands.add_parser('between', help='values of one sickness in a date range')
+between_parser.add_argument('name', type=str)
+between_parser.add_argument('--start', type=str, help='first date, YYYY-MM-DD')
+between_parser.add_argument('--end', type=str, help='last date, YYYY-MM-DD')
+
+rolling_parser = commands.add_parser('rolling', help='rolling sums of one sickness')
+rolling_parser.add_argument('name', type=str)
+rolling_parser.add_argument('--days', type=int, required=True, help='window length in days')
+rolling_parser.add_argument('--start', type=str, help='first date, YYYY-MM-DD')
+rolling_parser.add_argument('--end', type=str, help='last date, YYYY-MM-DD')
+
+top_parser = commands.add_parser('top', help='sicknesses with the highest values in a year')
+top_parser.add_argument('year', type=int)
+top_parser.add_argument('-n', type=int, default=DEFAULT_TOP, help=f'how many, defaults to {DEFAULT_TOP}')
+top_parser.add_argument('--aggregate', choices=list(AGGREGATES), default='mean', help='defaults to mean')
+
+
+def main(argv: t.Optional[t.List[str]] = None):
+    args = parser.parse_args(argv)
+    query = SicknessQuery.load(args.store)
+
+    if args.command == 'between':
+        rows = query.between(args.name, args.start, args.end)
+    elif args.command == 'rolling':
+        rows = query.rolling_sum(args.name, args.days, args.start, args.end)
+    else:
+        rows = query.top(args.year, args.n, args.aggregate)
+
+    for key, value in rows:
+        print(f'{key}\t{value:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import typing as t
+import os
+import shutil
+from datetime import date, datetime
+from functools import cached_property
+
+import numpy as np
+
+from columnar import save_columns, load_columns
+
+DateLike = t.Union[str, date, datetime, np.datetime64]
+DATE_UNIT = 'datetime64[s]'
+
+
+def to_datetime64(value: DateLike) -> np.datetime64:
+    return np.datetime64(value).astype(DATE_UNIT)
+
+
+def prefix_sums(values: np.ndarray) -> np.ndarray:
+    """
+    :return: (sicknesses, dates + 1) running totals of sickness-major `values`, missing values counted as 0
+    """
+    sums = np.zeros((values.shape[0], values.shape[1] + 1))
+    np.nancumsum(values, axis=1, out=sums[:, 1:])
+    return sums
+
+
+class SicknessStore:
+    """
+    Sickness x date matrix of one entry field (`per_30_days` by default), dates sorted, with per-sickness
+    prefix sums. Values are kept sickness-major, so the series of one sickness is a contiguous row.
+
+    Cells without an entry are NaN. When several entries share a date and name, the last one wins.
+    A store is saved as uncompressed .npy columns (see `columnar.save_columns`) and memory-mapped when
+    loaded, so a query about one sickness reads its rows only.
+    """
+    def __init__(
+            self,
+            dates: np.ndarray,
+            names: np.ndarray,
+            values: np.ndarray,
+            sums: t.Optional[np.ndarray] = None,
+    ):
+        self.dates = dates
+        self.names = names
+        self.values = values
+        self.sums = prefix_sums(values) if sums is None else sums
+
+    @classmethod
+    def from_entries(cls, entries: t.Iterable[t.Dict[str, t.Any]], field: str = 'per_30_days') -> 'SicknessStore':
+        """
+        one pass over `entries` - parser output may be streamed straight in
+        """
+        date_index: t.Dict[str, int] = {}
+        name_index: t.Dict[str, int] = {}
+        rows, columns, values = [], [], []
+        for entry in entries:
+            rows.append(date_index.setdefault(entry['measured'], len(date_index)))
+            columns.append(name_index.setdefault(entry['name'], len(name_index)))
+            values.append(entry[field])
+
+        dates = np.array([to_datetime64(d) for d in date_index], dtype=DATE_UNIT)
+        order = np.argsort(dates, kind='stable')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+
+        matrix = np.full((len(name_index), len(date_index)), np.nan)
+        matrix[np.array(columns, dtype=int), rank[np.array(rows, dtype=int)]] = values
+        return cls(dates[order], np.array(list(name_index), dtype=str), matrix)
+
+    @cached_property
+    def name_index(self) -> t.Dict[str, int]:
+        return {name: i for i, name in enumerate(self.names)}
+
+    def rows(self, start: t.Optional[DateLike], end: t.Optional[DateLike]) -> slice:
+        """
+        :return: positions of the dates measured within [start, end], found by binary search
+        """
+        first = 0 if start is None else np.searchsorted(self.dates, to_datetime64(start), side='left')
+        last = len(self.dates) if end is None else np.searchsorted(self.dates, to_datetime64(end), side='right')
+        return slice(int(first), int(last))
+
+    def between(self, start: t.Optional[DateLike] = None, end: t.Optional[DateLike] = None) -> 'SicknessStore':
+        rows = self.rows(start, end)
+        return SicknessStore(self.dates[rows], self.names, self.values[:, rows])
+
+    def series(
+            self,
+            name: str,
+            start: t.Optional[DateLike] = None,
+            end: t.Optional[DateLike] = None,
+    ) -> t.Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: (dates, values) of one sickness, without dates it was not reported on
+        """
+        rows = self.rows(start, end)
+        values = self.values[self.name_index[name], rows]
+        present = ~np.isnan(values)
+        return self.dates[rows][present], values[present]
+
+    def at(self, when: DateLike) -> t.Dict[str, float]:
+        row = self.rows(when, when)
+        if row.start == row.stop:
+            raise KeyError(when)
+        values = self.values[:, row.start]
+        return {str(name): float(value) for name, value in zip(self.names, values) if not np.isnan(value)}
+
+    def to_dict(self, missing: t.Any = 0) -> t.Dict[str, t.Dict[str, t.Any]]:
+        """
+        :return: {measured: {name: value}} as written to grouped-response.json, every name on every date
+        """
+        return {
+            measured: {name: missing if np.isnan(value) else float(value) for name, value in zip(self.names, row)}
+            for measured, row in zip(np.datetime_as_string(self.dates, unit='s'), self.values.T)
+        }
+
+    def save(self, path: str):
+        """
+        replaces the store directory `path` as a whole
+        """
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        save_columns(tmp_path, {
+            'dates': self.dates,
+            'names': self.names,
+            'values': np.ascontiguousarray(self.values),
+            'sums': np.ascontiguousarray(self.sums),
+        })
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'SicknessStore':
+        columns = load_columns(path)
+        return cls(columns['dates'], columns['names'], columns['values'], columns['sums'])
@@ -0,0 +1,95 @@
+"""
+Rebuilds rows of report tables from word boxes instead of word counts.
+
+The value columns of a page are found once: the x-extents of numeric words are merged wherever they overlap
+or nearly touch, so a number OCR split into '8' and '662' still falls into one column, and clusters found in
+too few lines (page numbers, dates in headers) are dropped. Every line is then read in a single sweep over
+its words - words left of the value columns make up the name, the rest go to the column they lie in.
+"""
+import typing as t
+from bisect import bisect_left
+
+import numpy as np
+
+from visionary import Cell, Line, Word
+
+VALUE_COLUMNS = 4
+COLUMN_GAP = 1.0  # numeric words closer than this many median word heights belong to the same column
+MIN_COLUMN_SUPPORT = 0.5  # a column needs words in this fraction of the lines of the best supported one
+
+
+class Column(t.NamedTuple):
+    left: float
+    right: float
+    support: int  # number of lines with a word in the column
+
+
+def infer_columns(lines: t.Sequence[Line], is_value: t.Callable[[Word], bool]) -> t.List[Column]:
+    """
+    :return: columns of the numeric words of lines with at least `VALUE_COLUMNS` of them, left to right
+    """
+    values: t.List[t.Tuple[Word, int]] = []
+    for row, line in enumerate(lines):
+        numeric = [word for word in line.words if is_value(word)]
+        if len(numeric) >= VALUE_COLUMNS:
+            values.extend((word, row) for word in numeric)
+    if not values:
+        return []
+
+    gap = COLUMN_GAP * float(np.median([word.height for word, _ in values]))
+    clusters: t.List[t.Tuple[float, float, t.Set[int]]] = []
+    for word, row in sorted(values, key=lambda value: value[0].pos_left):
+        if clusters and word.pos_left <= clusters[-1][1] + gap:
+            left, right, rows = clusters[-1]
+            clusters[-1] = left, max(right, word.pos_right), rows
+            rows.add(row)
+        else:
+            clusters.append((word.pos_left, word.pos_right, {row}))
+
+    best = max(len(rows) for _, _, rows in clusters)
+    return [Column(left, right, len(rows)) for left, right, rows in clusters if len(rows) >= MIN_COLUMN_SUPPORT * best]
+
+
+class Table:
+    """
+    the last `VALUE_COLUMNS` columns of a page, which `SicknessEntry` reads as `words[-4:]`
+    """
+    def __init__(self, columns: t.Sequence[Column], is_value: t.Callable[[Word], bool]):
+        self.columns = list(columns)[-VALUE_COLUMNS:]
+        self.is_value = is_value
+        self._rights = [column.right for column in self.columns]
+
+    @classmethod
+    def infer(cls, lines: t.Sequence[Line], is_value: t.Callable[[Word], bool]) -> t.Optional['Table']:
+        columns = infer_columns(lines, is_value)
+        return cls(columns, is_value) if len(columns) >= VALUE_COLUMNS else None
+
+    def row(self, line: Line) -> t.Optional[Line]:
+        """
+        :return: `line` with one word per value column - words sharing a column merged into a `Cell` - or None
+            when it is not a row of the table: a value column is empty or holds text, a word lies between or
+            past the columns, or the name is missing or ends with a number right next to the first column - a
+            piece of a value OCR shifted out of it. Other numbers are part of the name: 'u dzieci do lat 2'
+        """
+        name: t.List[Word] = []
+        cells: t.List[t.List[Word]] = [[] for _ in self.columns]
+        for word in line.words:
+            x = (word.pos_left + word.pos_right) / 2  # `pos_x` is rounded, which can put a digit left of its column
+            i = bisect_left(self._rights, x)
+            if i == len(self.columns):
+                return None
+            if x >= self.columns[i].left:
+                if not self.is_value(word):
+                    return None
+                cells[i].append(word)
+            elif i == 0:
+                name.append(word)
+            else:
+                return None
+
+        if len(name) < 2 or not all(cells) or self._touches_values(name[-1]):
+            return None
+        return Line(name + [words[0] if len(words) == 1 else Cell(words) for words in cells])
+
+    def _touches_values(self, word: Word) -> bool:
+        return self.is_value(word) and self.columns[0].left - word.pos_right <= COLUMN_GAP * word.height
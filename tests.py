@@ -1,5 +1,41 @@
+import io
+import os
+import json
+import random
+import threading
+import time
+import typing as t
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+from queue import Queue
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from unittest import TestCase, main
-from main import fix_werid_spacing
+from unittest.mock import patch
+
+import numpy as np
+
+import get_annotations
+import visionary
+from columnar import DictionaryColumn, save_columns, load_columns, padded_matrix
+from downloader import Downloader
+from fixtures import page_of_words, synthetic_document, synthetic_page, synthetic_row, synthetic_tabula_rows
+from fixtures import synthetic_word, CHAR_WIDTH, ROW_HEIGHT, VALUES_LEFT, VALUES_SPACING, WORD_HEIGHT
+from get_annotations import Annotator, AnnotationException
+from group_json import sicknesses_by_date
+import main as report_parser
+from main import ReportPage, scan_reports
+from manifest import Manifest
+from models import SicknessEntry
+from names import NameCanonicalizer
+from parser import fix_werid_spacing, sicknesses_from_rows, run_stage, _DONE
+from periods import normalize_periods
+from profiling import Profiler
+from query import SicknessQuery
+from store import SicknessStore
+from writers import EntryWriter, ColumnarWriter, JsonArrayWriter, NdjsonWriter, read_entries
+from visionary import DocumentFile, Geometry, Page, iter_pages_data, peek_page_count
 
 
 class TestCursor(TestCase):
@@ -44,5 +80,680 @@ class TestCursor(TestCase):
             print('.', end='')
 
 
+class TestPageLines(TestCase):
+    def test_skewed_rows_stay_together(self):
+        words = []
+        for top in [0.05, 0.1]:
+            for i, text in enumerate(['1', 'Odra', 'UE', '12', '3,4']):
+                # each word a quarter of its height lower than the previous one
+                words.append(synthetic_word(text, 0.05 + i * 0.1, top + i * WORD_HEIGHT / 4))
+
+        lines = list(Page('a.json', page_of_words(words)).lines)
+
+        self.assertEqual(['1 Odra UE 12 3,4'] * 2, [str(line) for line in lines])
+        self.assertLess(lines[0].pos_top, lines[1].pos_top)
+
+
+class TestParseReports(TestCase):
+    reports = ['1.01.1996-31.03.1996.pdf', '1.01.1996-15.01.1996.pdf', '16.01.1996-31.01.1996.pdf']
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        os.mkdir('downloads')
+        os.mkdir('result')
+        for seed, name in enumerate(self.reports):
+            open(os.path.join('downloads', name), 'w').close()
+            with open(os.path.join('result', name[:-4] + '.json'), 'w') as f:
+                f.write(json.dumps(synthetic_document(2, 10, seed=seed)))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def _parse(self, out: str, **kwargs) -> t.List[t.Dict[str, t.Any]]:
+        with redirect_stdout(io.StringIO()):
+            report_parser.main(output_format='ndjson', out=out, **kwargs)
+        return list(read_entries(out))
+
+    def test_jobs_keep_entries_in_report_order(self):
+        serial = self._parse('serial.ndjson', raw_names=True)
+        parallel = self._parse('parallel.ndjson', jobs=3, rebuild=True, raw_names=True)
+
+        self.assertEqual(3 * 2 * 10, len(serial))
+        self.assertEqual(serial, parallel)
+        self.assertEqual(['1996-01-15', '1996-01-31', '1996-03-31'], sorted({e['measured'][:10] for e in serial}))
+        self.assertEqual(sorted(serial, key=lambda e: e['measured']), serial)
+
+    def test_spawned_workers_profile(self):
+        with ProcessPoolExecutor(1, mp_context=get_context('spawn'), initializer=report_parser._enable_profiler) as pool:
+            entries, (events, counts) = pool.submit(report_parser._parse_report_profiled, self.reports[0]).result()
+        self.assertEqual(2 * 10, len(entries))
+        self.assertIn('report', {event.stage for event in events})
+        self.assertEqual(len(entries), counts[self.reports[0], 'entries'])
+
+
+class TestWriters(TestCase):
+    entries = [
+        {'name': 'Odra', 'per_30_days': 1.5, 'started': '2000-01-01T00:00:00', 'values': [1., 2., 3., 4.]},
+        {'name': 'Zakażenie "X"', 'per_30_days': 0., 'started': '2000-01-01T00:00:00', 'values': []},
+    ]
+
+    def test_writer_without_write_fails_when_created(self):
+        class Incomplete(EntryWriter):
+            pass
+
+        with self.assertRaises(TypeError):
+            Incomplete('out.json')
+
+    def test_json_array_matches_dumps(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'response.json')
+            for entries in [self.entries, []]:
+                with JsonArrayWriter(path) as writer:
+                    for entry in entries:
+                        writer.write(entry)
+                with open(path) as f:
+                    self.assertEqual(json.dumps(entries, indent=2), f.read())
+                self.assertEqual(entries, list(read_entries(path)))
+
+    def test_ndjson_is_read_back(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'response.ndjson')
+            with NdjsonWriter(path) as writer:
+                for entry in self.entries:
+                    writer.write(entry)
+            self.assertEqual(self.entries, list(read_entries(path)))
+
+    def test_aborted_run_keeps_previous_output(self):
+        for writer_type in [JsonArrayWriter, NdjsonWriter]:
+            with TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'response')
+                with open(path, 'w') as f:
+                    f.write('previous')
+
+                with self.assertRaises(KeyboardInterrupt):
+                    with writer_type(path) as writer:
+                        writer.write(self.entries[0])
+                        raise KeyboardInterrupt
+
+                with open(path) as f:
+                    self.assertEqual('previous', f.read())
+                self.assertEqual(['response'], os.listdir(tmp))
+
+    def test_columns_replace_previous_ones_on_clean_exit_only(self):
+        entries = [{**entry, 'measured': '2000-03-31T00:00:00'} for entry in self.entries]
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'response.columns')
+            with ColumnarWriter(path) as writer:
+                writer.write(entries[0])
+
+            with self.assertRaises(KeyboardInterrupt):
+                with ColumnarWriter(path) as writer:
+                    writer.write(entries[1])
+                    raise KeyboardInterrupt
+            self.assertEqual(['Odra'], list(load_columns(path)['name'].decode()))
+
+            with ColumnarWriter(path) as writer:
+                for entry in entries:
+                    writer.write(entry)
+            self.assertEqual(['Odra', 'Zakażenie "X"'], list(load_columns(path)['name'].decode()))
+            self.assertEqual(['response.columns'], os.listdir(tmp))
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    serves `files` with an ETag (unless `etag` is None), answering conditional and range requests
+    """
+    files = {'/report.pdf': b'%PDF-' + bytes(range(256)) * 40}
+    etag = '"v1"'
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def _send_headers(self, status: int, length: int, extra: dict = None):
+        self.send_response(status)
+        if self.etag:
+            self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(length))
+        for k, v in (extra or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.requests.append(('HEAD', dict(self.headers)))
+        self._send_headers(200, len(self.files[self.path]))
+
+    def do_GET(self):
+        self.requests.append(('GET', dict(self.headers)))
+        body = self.files[self.path]
+        if self.etag and self.headers.get('If-None-Match') == self.etag:
+            return self._send_headers(304, 0)
+
+        byte_range = self.headers.get('Range')
+        if byte_range and self.headers.get('If-Range', self.etag) == self.etag:
+            start = int(byte_range.split('=')[1].rstrip('-'))
+            self._send_headers(206, len(body) - start, {'Content-Range': f'bytes {start}-{len(body) - 1}/{len(body)}'})
+            return self.wfile.write(body[start:])
+
+        self._send_headers(200, len(body))
+        self.wfile.write(body)
+
+
+class TestManifest(TestCase):
+    entries = [{'name': 'Odra', 'per_30_days': 1.5, 'started': '2000-01-01T00:00:00', 'values': [1., 2.]}]
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'manifest.json')
+        self.source = os.path.join(self.tmp.name, 'report.json')
+        with open(self.source, 'w') as f:
+            f.write('{"responses": []}')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _record(self, parser_version: int = 1):
+        manifest = Manifest(self.path, parser_version)
+        manifest.update('report.pdf', self.source, self.entries)
+        manifest.save()
+
+    def test_reuses_unchanged_report(self):
+        self._record()
+        self.assertEqual(self.entries, Manifest.load(self.path, 1).entries('report.pdf', self.source))
+
+    def test_hash_fallback_when_only_mtime_changed(self):
+        self._record()
+        stat = os.stat(self.source)
+        os.utime(self.source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+        manifest = Manifest.load(self.path, 1)
+        self.assertEqual(self.entries, manifest.entries('report.pdf', self.source))
+        manifest.save()
+        with open(self.path) as f:
+            self.assertEqual(os.stat(self.source).st_mtime_ns, json.load(f)['reports']['report.pdf']['mtime'])
+
+    def test_content_changed_at_same_size(self):
+        self._record()
+        with open(self.source, 'w') as f:
+            f.write('{"responses": {}}')
+        self.assertEqual(len('{"responses": []}'), os.path.getsize(self.source))
+        self.assertIsNone(Manifest.load(self.path, 1).entries('report.pdf', self.source))
+
+    def test_parser_version_invalidates_everything(self):
+        self._record(parser_version=1)
+        self.assertIsNone(Manifest.load(self.path, 2).entries('report.pdf', self.source))
+
+    def test_save_keeps_only_reports_seen(self):
+        self._record()
+        manifest = Manifest.load(self.path, 1)
+        manifest.save()
+        self.assertIsNone(Manifest.load(self.path, 1).entries('report.pdf', self.source))
+
+
+class TestDownloader(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.link = f'http://127.0.0.1:{self.server.server_port}/report.pdf'
+        self.tmp = TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'report.pdf')
+        self.body = StandInHandler.files['/report.pdf']
+        self.downloader = lambda: Downloader(self.tmp.name, 2, os.path.join(self.tmp.name, 'state.json'))
+        StandInHandler.requests = []
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_download_then_not_modified(self):
+        self.assertEqual([('report', 'DOWNLOADED')], list(self.downloader().fetch_all([('report', self.link)])))
+        self.assertEqual([('report', 'NOT MODIFIED')], list(self.downloader().fetch_all([('report', self.link)])))
+        with open(self.path, 'rb') as f:
+            self.assertEqual(self.body, f.read())
+
+    def test_skips_existing_file_with_matching_size(self):
+        with open(self.path, 'wb') as f:
+            f.write(self.body)
+
+        self.assertEqual('SKIPPED', self.downloader().fetch('report', self.link))
+        self.assertEqual(['HEAD'], [method for method, headers in StandInHandler.requests])
+
+    def test_size_check_without_validators(self):
+        with patch.object(StandInHandler, 'etag', None):
+            self.assertEqual('DOWNLOADED', self.downloader().fetch('report', self.link))
+            self.assertEqual('SKIPPED', self.downloader().fetch('report', self.link))
+            self.assertEqual('SKIPPED', self.downloader().fetch('report', self.link))
+        self.assertEqual(['GET', 'HEAD', 'HEAD'], [method for method, headers in StandInHandler.requests])
+
+    def test_resumes_partial_download(self):
+        with open(self.path + '.part', 'wb') as f:
+            f.write(self.body[:1000])
+
+        self.assertEqual('RESUMED', self.downloader().fetch('report', self.link))
+        self.assertEqual('bytes=1000-', StandInHandler.requests[-1][1]['Range'])
+        with open(self.path, 'rb') as f:
+            self.assertEqual(self.body, f.read())
+
+
+class MockVisionHandler(BaseHTTPRequestHandler):
+    """
+    stalls the first `stalls` requests without answering, rate-limits every first request of the rest, then
+    echoes one response per requested file
+    """
+    bodies = []
+    stalls = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if MockVisionHandler.stalls:
+            MockVisionHandler.stalls -= 1
+            return time.sleep(0.5)
+
+        self.bodies.append(body)
+        if len(self.bodies) % 2:
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            return self.end_headers()
+
+        data = json.dumps({'responses': [
+            {'inputConfig': request['inputConfig'], 'responses': [], 'totalPages': 0}
+            for request in body['requests']
+        ]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class TestAnnotator(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), MockVisionHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/v1/files:annotate'
+        self.tmp = TemporaryDirectory()
+        MockVisionHandler.bodies = []
+        MockVisionHandler.stalls = 0
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_retries_batches_and_skips_existing_results(self):
+        with open(os.path.join(self.tmp.name, 'a.json'), 'w') as f:
+            f.write('{}')
+
+        annotator = Annotator('token', self.url, in_flight=1, batch_size=2, backoff=0)
+        written = list(annotator.annotate(['a.pdf', 'b.pdf', 'c.pdf'], self.tmp.name))
+
+        self.assertEqual(['b.pdf', 'c.pdf'], [filename for filename, path in written])
+        self.assertEqual(2, len(MockVisionHandler.bodies))  # rate limited once, then one batch of two
+        with open(os.path.join(self.tmp.name, 'c.json')) as f:
+            uri = json.load(f)['responses'][0]['inputConfig']['gcsSource']['uri']
+        self.assertTrue(uri.endswith('/c.pdf'))
+
+    def test_retries_stalled_requests(self):
+        MockVisionHandler.stalls = 1
+        annotator = Annotator('token', self.url, in_flight=1, backoff=0, timeout=0.2)
+        self.assertEqual(['a.pdf'], [filename for filename, path in annotator.annotate(['a.pdf'], self.tmp.name)])
+        self.assertEqual(2, len(MockVisionHandler.bodies))  # timed out and rate limited once each
+
+        MockVisionHandler.stalls = 3
+        annotator = Annotator('token', self.url, in_flight=1, max_retries=2, backoff=0, timeout=0.2)
+        with self.assertRaises(AnnotationException):
+            list(annotator.annotate(['b.pdf'], self.tmp.name))
+
+    def test_main_skips_partial_downloads(self):
+        for name in ['a.pdf', 'b.pdf.part', 'notes.txt']:
+            open(os.path.join(self.tmp.name, name), 'w').close()
+
+        with patch.object(get_annotations, 'DOWNLOAD_DIR', self.tmp.name), \
+                patch.object(get_annotations, 'get_token', return_value='token'), \
+                patch.object(Annotator, 'annotate', return_value=iter([])) as annotate, \
+                redirect_stdout(io.StringIO()):
+            get_annotations.main()
+        self.assertEqual(['a.pdf'], list(annotate.call_args[0][0]))
+
+
+class TestSicknessesFromRows(TestCase):
+    def test_synthetic_tabula_table(self):
+        sicknesses = list(sicknesses_from_rows(synthetic_tabula_rows(30)))
+        self.assertEqual(list(range(1, 31)), [sickness.index for sickness in sicknesses])
+        self.assertTrue(all(len(sickness.values) == 4 for sickness in sicknesses))
+        self.assertEqual('razem', sicknesses[0].subcategory)
+        self.assertIsNone(sicknesses[1].name)
+
+
+class TestRunStage(TestCase):
+    def _run(self, func: t.Callable[[str, t.Any], t.Any], items: t.List[t.Tuple[str, t.Any]], workers: int):
+        inbox, outbox = Queue(), Queue()
+        for item in items:
+            inbox.put(item)
+        inbox.put(_DONE)
+        for thread in run_stage(func, inbox, outbox, workers):
+            thread.join(timeout=5)
+        return [outbox.get_nowait() for _ in range(outbox.qsize())]
+
+    def test_single_worker_keeps_order(self):
+        items = [(str(i), i) for i in range(20)]
+        self.assertEqual([(d, i * 2) for d, i in items] + [_DONE], self._run(lambda d, i: i * 2, items, 1))
+
+    def test_done_once_after_every_worker(self):
+        def _slow(date: str, payload: int) -> int:
+            time.sleep(random.random() / 100)
+            return payload
+
+        results = self._run(_slow, [(str(i), i) for i in range(20)], 4)
+        self.assertEqual(_DONE, results[-1])
+        self.assertEqual(1, results.count(_DONE))
+        self.assertEqual(list(range(20)), sorted(payload for _, payload in results[:-1]))
+
+    def test_failures_are_passed_downstream(self):
+        def _fail_odd(date: str, payload: int) -> int:
+            if payload % 2:
+                raise ValueError(date)
+            return payload
+
+        called = []
+        first = self._run(_fail_odd, [('0', 0), ('1', 1)], 1)
+        second = self._run(lambda d, p: called.append(d) or p, first[:-1], 1)
+
+        self.assertEqual(('0', 0), second[0])
+        self.assertEqual('1', second[1][0])
+        self.assertIsInstance(second[1][1], ValueError)
+        self.assertIs(first[1][1], second[1][1])
+        self.assertEqual(['0'], called)
+
+
+class TestColumnar(TestCase):
+    def test_round_trip_is_memory_mapped(self):
+        with TemporaryDirectory() as tmp:
+            save_columns(tmp, {
+                'name': DictionaryColumn.encode(['Odra', 'Grypa', 'Odra', None]),
+                'values': padded_matrix([[1., 2.], [3.], [], [4., 5.]]),
+            })
+            columns = load_columns(tmp)
+
+            self.assertIsInstance(columns['values'], np.memmap)
+            self.assertEqual(['Odra', 'Grypa', 'Odra', ''], list(columns['name'].decode()))
+            self.assertEqual(['Odra', 'Grypa', ''], list(columns['name'].categories))
+            np.testing.assert_array_equal([[1., 2.], [3., np.nan], [np.nan, np.nan], [4., 5.]], columns['values'])
+
+
+class TestSicknessStore(TestCase):
+    entries = [
+        {'name': 'Odra', 'per_30_days': 1., 'measured': '2000-03-31T00:00:00'},
+        {'name': 'Odra', 'per_30_days': 2., 'measured': '2000-01-15T00:00:00'},
+        {'name': 'Grypa', 'per_30_days': 3., 'measured': '2000-03-31T00:00:00'},
+        {'name': 'Grypa', 'per_30_days': 4., 'measured': '2001-01-15T00:00:00'},
+    ]
+
+    def test_interleaved_dates_are_merged_and_sorted(self):
+        self.assertEqual({
+            '2000-01-15T00:00:00': {'Odra': 2., 'Grypa': 0},
+            '2000-03-31T00:00:00': {'Odra': 1., 'Grypa': 3.},
+            '2001-01-15T00:00:00': {'Odra': 0, 'Grypa': 4.},
+        }, sicknesses_by_date(iter(self.entries)))
+
+    def test_range_queries_and_serialisation(self):
+        store = SicknessStore.from_entries(self.entries)
+        with TemporaryDirectory() as tmp:
+            store.save(os.path.join(tmp, 'store'))
+            store = SicknessStore.load(os.path.join(tmp, 'store'))
+            self.assertIsInstance(store.sums, np.memmap)
+
+        dates, values = store.series('Grypa', start='2000-02-01')
+        self.assertEqual([3., 4.], list(values))
+        self.assertEqual(['2000-03-31T00:00:00'], [str(d) for d in store.between('2000-02-01', '2000-12-31').dates])
+        self.assertEqual({'Odra': 2.}, store.at('2000-01-15'))
+
+
+class TestSicknessQuery(TestCase):
+    def setUp(self):
+        self.query = SicknessQuery(SicknessStore.from_entries([
+            {'name': name, 'per_30_days': value, 'measured': measured}
+            for name, value, measured in [
+                ('Odra', 1., '2000-01-15'), ('Odra', 2., '2000-03-31'), ('Odra', 4., '2001-01-15'),
+                ('Grypa', 10., '2000-03-31'), ('Ospa', 5., '2000-01-15'), ('Ospa', 3., '2000-03-31'),
+            ]
+        ]))
+
+    def test_between_and_total(self):
+        self.assertEqual([('2000-03-31', 2.), ('2001-01-15', 4.)], self.query.between('Odra', start='2000-02-01'))
+        self.assertEqual(3., self.query.total('Odra', end='2000-12-31'))
+
+    def test_rolling_sum(self):
+        self.assertEqual(
+            [('2000-01-15', 1.), ('2000-03-31', 3.), ('2001-01-15', 4.)],
+            self.query.rolling_sum('Odra', days=90),
+        )
+
+    def test_top(self):
+        self.assertEqual([('Grypa', 10.), ('Ospa', 4.)], self.query.top(2000, n=2))
+        self.assertEqual([('Odra', 4.)], self.query.top(2001))
+
+
+class TestNormalizePeriods(TestCase):
+    def test_cumulative_reports_are_differenced(self):
+        reports = [  # cumulative reports of 1996 and one half-month report
+            ('1996-01-01', '1996-01-15', {'Odra': 10., 'Grypa': 1.}),
+            ('1996-01-01', '1996-03-31', {'Odra': 30., 'Grypa': 4.}),
+            ('1996-01-01', '1996-06-30', {'Odra': 50.}),
+            ('1996-01-01', '1996-12-31', {'Odra': 100., 'Grypa': 10.}),
+            ('1996-01-16', '1996-01-31', {'Odra': 5., 'Grypa': 1.}),
+        ]
+        entries = [
+            {'name': name, 'values': [value, 0., 0., 0.], 'started': f'{start}T00:00:00', 'measured': f'{end}T00:00:00'}
+            for start, end, values in reports for name, value in values.items()
+        ]
+
+        periods = [(e['started'][:10], e['measured'][:10], e['name'], e['value']) for e in normalize_periods(entries)]
+
+        self.assertEqual([
+            ('1996-01-01', '1996-01-15', 'Odra', 10.), ('1996-01-01', '1996-01-15', 'Grypa', 1.),
+            ('1996-01-16', '1996-01-31', 'Odra', 5.), ('1996-01-16', '1996-01-31', 'Grypa', 1.),
+            ('1996-02-01', '1996-03-31', 'Odra', 15.), ('1996-02-01', '1996-03-31', 'Grypa', 2.),
+            ('1996-04-01', '1996-06-30', 'Odra', 20.),
+            ('1996-04-01', '1996-12-31', 'Grypa', 6.),  # not listed on 30.06, so spans it
+            ('1996-07-01', '1996-12-31', 'Odra', 50.),
+        ], periods)
+        self.assertEqual({'Odra': 100., 'Grypa': 10.}, {
+            name: sum(value for *_, period_name, value in periods if period_name == name) for name in ['Odra', 'Grypa']
+        })
+
+
+class TestNameCanonicalizer(TestCase):
+    def test_ocr_variants_share_a_name_and_aliases_persist(self):
+        names = NameCanonicalizer()
+        canonical = names.canonical('inne zakażenie pozajelitowe PL')
+        for variant in ['inne zaka żenie pozajelitowe PL', 'inne zakazenie poza-jelitowe PL', 'inne zakażenie pozajelitowa PL']:
+            self.assertEqual(canonical, names.canonical(variant))
+        self.assertEqual('Odra', names.canonical('Odra'))
+        self.assertEqual('razem', names.canonical('razem'))
+
+        with TemporaryDirectory() as tmp:
+            names.save(os.path.join(tmp, 'aliases.json'))
+            loaded = NameCanonicalizer.load(os.path.join(tmp, 'aliases.json'))
+
+        self.assertEqual(names.aliases, loaded.aliases)
+        self.assertEqual(canonical, loaded.canonical('inne zakażenie pozajelitowe  PL'))
+
+    def test_names_differing_in_a_letter_or_number_stay_apart(self):
+        names = NameCanonicalizer()
+        for name in ['Wirusowe zapalenie wątroby typu A', 'Wirusowe zapalenie wątroby typu B',
+                     'Wirusowe zapalenie wątroby typu C', 'Grypa u dzieci do lat 4', 'Grypa u dzieci do lat 14']:
+            self.assertEqual(name, names.canonical(name))
+        self.assertEqual('Wirusowe zapalenie wątroby typu B', names.canonical('Wirusowe zapalenie wątroby typu  B'))
+
+    def test_row_index_is_not_part_of_the_name(self):
+        names = NameCanonicalizer()
+        self.assertEqual('Odra', names.canonical('12 Odra'))
+        self.assertEqual('Odra', names.canonical('14 Odra'))
+        self.assertEqual('inne zakażenie pozajelitowe PL', names.canonical('3 inne zakażenie pozajelitowe PL'))
+        self.assertEqual('inne zakażenie pozajelitowe PL', names.canonical('31 inne zakaźenie pozajelitowe PL'))
+
+    def test_subrows_of_one_report_stay_apart(self):
+        raws = ['4 razem', '9 razem', '19 razem', '16 inne określone', '23 inne określone', '34 ogółem', '45 ogółem',
+                '12 Odra']
+        names = NameCanonicalizer()
+        canonical = names.canonical_rows(raws)
+        self.assertEqual(['4 razem', '9 razem', '19 razem', '16 inne określone', '23 inne określone',
+                          '34 ogółem', '45 ogółem', 'Odra'], canonical)
+        self.assertEqual(['4 razem', 'Odra'], names.canonical_rows(['4 rażem', '12 Odra']))
+
+        entries = [
+            {'name': name, 'per_30_days': float(i), 'measured': '2000-01-31T00:00:00'}
+            for i, name in enumerate(canonical)
+        ]
+        store = SicknessStore.from_entries(entries)
+        self.assertEqual(len(raws), len(store.names))
+        np.testing.assert_array_equal(np.arange(len(raws)), store.values[:, 0])
+
+
+class TestReportFile(TestCase):
+    def test_page_count_is_peeked_without_decoding(self):
+        pages = [{'context': {'uri': 'gs://bucket/a.pdf', 'pageNumber': i}} for i in range(1, 4)]
+        with TemporaryDirectory() as tmp:
+            with_total, without_total = os.path.join(tmp, 'a.json'), os.path.join(tmp, 'b.json')
+            with open(with_total, 'w') as f:
+                f.write(json.dumps({'responses': [{'responses': pages, 'totalPages': 3}]}, indent=2))
+            with open(without_total, 'w') as f:
+                f.write(json.dumps({'responses': [{'responses': pages}]}))
+
+            self.assertEqual(3, peek_page_count(with_total))
+            # small chunks split "pageNumber" keys between reads
+            for size in [5, 7, 13]:
+                with patch.object(visionary, 'PEEK_SIZE', size):
+                    self.assertEqual(3, peek_page_count(without_total))
+
+    def test_pages_are_streamed_in_any_chunk_size(self):
+        pages = [{'context': {'pageNumber': i}, 'fullTextAnnotation': {'text': f'strona {i} ]}}"\\'}} for i in range(3)]
+        document = {'responses': [
+            {'inputConfig': {'gcsSource': {'uri': 'gs://bucket/a.pdf'}}, 'responses': pages, 'totalPages': 12345},
+            {'responses': [{'context': {'pageNumber': 99}}]},
+        ]}
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'a.json')
+            for indent in [None, 2]:
+                with open(path, 'w') as f:
+                    f.write(json.dumps(document, indent=indent))
+                for size in [1, 3, 64, 1 << 20]:
+                    self.assertEqual(pages, list(iter_pages_data(path, size)))
+
+    def test_scan_reports_sorts_by_end_date(self):
+        with TemporaryDirectory() as tmp:
+            for name in ['1.01.1996-31.03.1996.pdf', '1.01.1996-15.01.1996.pdf', '16.01.1996-31.01.1996.pdf',
+                         '1.01.1996-31.03.1996.pdf.part']:
+                open(os.path.join(tmp, name), 'w').close()
+            os.mkdir(os.path.join(tmp, 'nested.pdf'))
+
+            reports = scan_reports(tmp)
+
+        self.assertEqual(
+            ['1.01.1996-15.01.1996.pdf', '16.01.1996-31.01.1996.pdf', '1.01.1996-31.03.1996.pdf'],
+            [r.pdf_name for r in reports],
+        )
+        self.assertEqual('16.01.1996', reports[1].start_date.strftime('%d.%m.%Y'))
+
+
+class TestReportPage(TestCase):
+    def test_data_entries(self):
+        for word in ['1 272', '12,5', '-', '–', ' 7 ', '²']:
+            self.assertTrue(ReportPage._is_data_entry(word), word)
+        for word in ['', ' ', '12.5', 'PL', '1a', '--']:
+            self.assertFalse(ReportPage._is_data_entry(word), word)
+
+    def test_split_numbers_are_read_by_column(self):
+        rng = random.Random(0)
+        words = [word for i in range(10) for word in synthetic_row(i + 1, 0.05 + i * ROW_HEIGHT, rng)]
+        split_rows = [
+            ('11 razem', [['8', '662'], ['22,54'], ['8', '646'], ['22,50']]),
+            ('12 w tym u dzieci do lat 2', [['14', '314'], ['1', '876,45'], ['13', '714'], ['1', '797,80']]),
+        ]
+        for row, (name, values) in enumerate(split_rows):
+            top = 0.05 + (10 + row) * ROW_HEIGHT
+            left = 0.05
+            for part in name.split():
+                words.append(synthetic_word(part, left, top))
+                left += (len(part) + 1) * CHAR_WIDTH
+            for column, parts in enumerate(values):
+                left = VALUES_LEFT + column * VALUES_SPACING
+                for part in parts:
+                    words.append(synthetic_word(part, left, top))
+                    left += (len(part) + 1) * CHAR_WIDTH
+        page = Page('a.json', page_of_words(words))
+        self.assertEqual(10, sum(map(ReportPage._is_stat_line, page.lines)))
+        entries = [SicknessEntry(line, None, None, 'a.pdf') for line in ReportPage(page).padded_lines]
+        self.assertEqual(12, len(entries))
+        self.assertEqual('11 razem', entries[-2].name)
+        self.assertEqual((8662., 22.54, 8646., 22.5), entries[-2].values)
+        self.assertEqual('12 w tym u dzieci do lat 2', entries[-1].name)
+        self.assertEqual((14314., 1876.45, 13714., 1797.8), entries[-1].values)
+
+
+class TestGeometry(TestCase):
+    def test_packed_pages_match_json_and_follow_changes(self):
+        def padded_lines(pages):
+            return [str(line) for page in pages for line in ReportPage(page).padded_lines]
+
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'a.json')
+            with open(path, 'w') as f:
+                f.write(json.dumps({'responses': [{'responses': [synthetic_page(20, 1), synthetic_page(5, 2, seed=1)]}]}))
+
+            packed = list(DocumentFile(path).iter_pages())
+            decoded = DocumentFile(path).pages
+            self.assertEqual([1, 2], [page.pagenum for page in packed])
+            self.assertEqual(padded_lines(decoded), padded_lines(packed))
+            for packed_word, word in zip(packed[0].words, decoded[0].words):
+                self.assertEqual((str(word), word.symbol_widths), (str(packed_word), packed_word.symbol_widths))
+                self.assertEqual(word.vertices, packed_word.vertices)
+            self.assertIsInstance(Geometry.open(path).vertices, np.memmap)
+
+            with open(path, 'w') as f:
+                f.write(json.dumps({'responses': [{'responses': [synthetic_page(3, 7)]}]}))
+            self.assertEqual([7], [page.pagenum for page in DocumentFile(path).iter_pages()])
+            self.assertEqual(3, len(padded_lines(DocumentFile(path).iter_pages())))
+
+
+class TestProfiler(TestCase):
+    def test_nested_stages_and_worker_records(self):
+        profiler = Profiler()
+        with profiler.stage('report', 'a.pdf'):
+            profiler.count('pages')
+        self.assertEqual(([], {}), profiler.drain())
+
+        profiler.enable()
+        try:
+            with profiler.stage('report', 'a.pdf'):
+                with profiler.stage('decode'):
+                    data = bytearray(1 << 20)
+                del data
+                profiler.count('entries', 3)
+            worker = Profiler()
+            worker.enable()
+            with worker.stage('report', 'b.pdf'):
+                worker.count('entries', 2)
+            profiler.merge(worker.drain())
+        finally:
+            profiler.disable()
+
+        decode, report, other = profiler.events
+        self.assertEqual(('decode', 'a.pdf'), (decode.stage, decode.report))
+        self.assertGreaterEqual(report.peak, decode.peak)
+        self.assertGreaterEqual(decode.peak, 1 << 20)
+        self.assertEqual({('a.pdf', 'entries'): 3, ('b.pdf', 'entries'): 2}, dict(profiler.counts))
+        self.assertIn('decode', profiler.summary())
+        self.assertEqual(3, len(profiler.chrome_trace()['traceEvents']))
+
+
 if __name__ == '__main__':
     main()
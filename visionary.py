@@ -1,15 +1,33 @@
 import typing as t
+import os
+import shutil
 from dataclasses import dataclass
 from os import listdir
-from json import loads
-from itertools import chain, groupby
+from os.path import getmtime
+from json import loads, JSONDecoder
+import re
+from itertools import chain
+from functools import lru_cache, cached_property
 from datetime import datetime
 
+import numpy as np
+
+from columnar import save_columns, load_columns
+from profiling import profiler
+
 Vertex = (float, float)
 BoxVertices = (Vertex, Vertex, Vertex, Vertex)
 PRECISION = 2
 PRINT_SCALE = 0.05
 EMPTY_VERTICES: BoxVertices = ((0, 0), (0, 0), (0, 0), (0, 0))
+DOCUMENT_CACHE_SIZE = 8
+LINE_TOLERANCE = 0.5  # max gap between consecutive word centres in a line, as a fraction of median word height
+PEEK_SIZE = 1 << 16
+TOTAL_PAGES = re.compile(rb'"totalPages":\s*(\d+)')
+PAGE_NUMBER = b'"pageNumber"'
+STREAM_CHUNK_SIZE = 1 << 20
+GEOMETRY_SUFFIX = '.geometry'
+GEOMETRY_VERSION = 1  # bump whenever `pack_pages` changes what it stores
 
 
 def to_vertices(vertex_raw: t.Dict[str, float]) -> Vertex:
@@ -20,15 +38,181 @@ def parse_date(raw: str) -> datetime:
     return datetime.strptime(raw, '%d.%m.%Y')
 
 
+@lru_cache(maxsize=DOCUMENT_CACHE_SIZE)
+def _load_document(json_path: str, mtime: float) -> t.Dict[str, t.Any]:
+    """
+    decoded Vision responses are shared between `DocumentFile` instances until the file changes on disk
+    """
+    with open(json_path) as f:
+        return loads(f.read())
+
+
+def peek_page_count(json_path: str) -> int:
+    """
+    page count of a Vision response without decoding it: `totalPages` is read from the end of the file,
+    otherwise the per-page `"pageNumber"` keys are counted chunk by chunk
+    """
+    with open(json_path, 'rb') as f:
+        f.seek(0, 2)
+        f.seek(max(f.tell() - PEEK_SIZE, 0))
+        match = TOTAL_PAGES.search(f.read())
+        if match:
+            return int(match.group(1))
+
+        f.seek(0)
+        count, tail = 0, b''
+        for chunk in iter(lambda: f.read(PEEK_SIZE), b''):
+            # the carried tail is too short to hold a whole key, so one split between chunks counts once
+            window = tail + chunk
+            count += window.count(PAGE_NUMBER)
+            tail = window[-(len(PAGE_NUMBER) - 1):]
+        return count
+
+
+class _JsonStream:
+    """
+    Pulls JSON values out of a text file one at a time with `raw_decode`, reading only as much as the next
+    value needs. A value that does not fit the buffer yet is retried after at least doubling what is buffered,
+    so a large value costs a few decode attempts rather than one per chunk.
+    """
+    _decoder = JSONDecoder()
+
+    def __init__(self, f: t.TextIO, chunk_size: int = STREAM_CHUNK_SIZE):
+        self._file = f
+        self._chunk_size = chunk_size
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._expected_size = 0
+
+    def _fill(self, size: int):
+        chunk = self._file.read(size)
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        self._eof = len(chunk) < size
+
+    def _skip_whitespace(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\n\r':
+                self._pos += 1
+            if self._pos < len(self._buffer) or self._eof:
+                return
+            self._fill(self._chunk_size)
+
+    def token(self, expected: str) -> str:
+        """
+        consumes one structural character out of `expected`
+        """
+        self._skip_whitespace()
+        if self._pos == len(self._buffer) or self._buffer[self._pos] not in expected:
+            found = self._buffer[self._pos:self._pos + 1] or 'end of file'
+            raise ValueError(f'expected one of {expected!r} in {self._file.name}, found {found!r}')
+        self._pos += 1
+        return self._buffer[self._pos - 1]
+
+    def value(self) -> t.Any:
+        self._skip_whitespace()
+        buffered = len(self._buffer) - self._pos
+        if buffered < self._expected_size and not self._eof:
+            self._fill(self._expected_size - buffered + self._chunk_size)
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # a number cut by the end of the buffer decodes too, but may go on
+                if end < len(self._buffer) or self._eof:
+                    self._expected_size = end - self._pos
+                    self._pos = end
+                    return value
+            except ValueError:
+                if self._eof:
+                    raise
+            self._fill(max(self._chunk_size, len(self._buffer) - self._pos))
+
+    def members(self) -> t.Iterator[str]:
+        """
+        walks an object: yields each key and expects its value to be consumed before the next one
+        """
+        self.token('{')
+        self._skip_whitespace()
+        if self._buffer.startswith('}', self._pos):
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self.token(':')
+            yield key
+            if self.token(',}') == '}':
+                return
+
+    def items(self) -> t.Iterator[None]:
+        """
+        walks an array: yields once per element, which is to be consumed before the next one
+        """
+        self.token('[')
+        self._skip_whitespace()
+        if self._buffer.startswith(']', self._pos):
+            self._pos += 1
+            return
+        while True:
+            yield
+            if self.token(',]') == ']':
+                return
+
+
+def iter_pages_data(json_path: str, chunk_size: int = STREAM_CHUNK_SIZE) -> t.Iterator[t.Dict[str, t.Any]]:
+    """
+    decodes `responses[0]['responses']` of a Vision response page by page, so only one page is held at a time;
+    `inputConfig` and anything else next to the pages is skipped
+    """
+    with open(json_path) as f:
+        stream = _JsonStream(f, chunk_size)
+        for key in stream.members():
+            if key != 'responses':
+                stream.value()
+                continue
+            for _ in stream.items():
+                for file_key in stream.members():
+                    if file_key != 'responses':
+                        stream.value()
+                        continue
+                    for _ in stream.items():
+                        yield stream.value()
+                return  # only the first file is read, as with `_pages_data`
+
+
 def avg(x: t.Union[float, int], y: t.Union[float, int]) -> float:
     return (x + y) / 2
 
 
+class Box:
+    """
+    axis-aligned bounding box, computed once from the raw vertices
+    """
+    __slots__ = ('left', 'top', 'right', 'bottom', 'x', 'y')
+
+    def __init__(self, left: float, top: float, right: float, bottom: float):
+        self.left = left
+        self.top = top
+        self.right = right
+        self.bottom = bottom
+        self.x = round(avg(left, right), PRECISION)
+        self.y = round(avg(bottom, top), PRECISION)
+
+    @classmethod
+    def from_vertices(cls, vertices: BoxVertices) -> 'Box':
+        xs = [x for x, y in vertices]
+        ys = [y for x, y in vertices]
+        return cls(min(xs), min(ys), max(xs), max(ys))
+
+    def __repr__(self):
+        return f'<Box ({self.left}, {self.top}) ({self.right}, {self.bottom})>'
+
+
 @dataclass(frozen=True, eq=True)
 class VerticesMixin:
     raw: t.Dict[str, t.Any]
 
-    @property
+    @cached_property
     def vertices(self) -> BoxVertices:
         """
         :return: (left-top, right-top, right-bottom, left-bottom)
@@ -38,6 +222,10 @@ class VerticesMixin:
         except KeyError:
             return EMPTY_VERTICES
 
+    @cached_property
+    def box(self) -> Box:
+        return Box.from_vertices(self.vertices)
+
     @property
     def _y_positions(self) -> t.Iterable[float]:
         return (y for x, y in self.vertices)
@@ -48,27 +236,27 @@ class VerticesMixin:
 
     @property
     def pos_top(self) -> float:
-        return min(self._y_positions)
+        return self.box.top
 
     @property
     def pos_bottom(self) -> float:
-        return max(self._y_positions)
+        return self.box.bottom
 
     @property
     def pos_left(self) -> float:
-        return min(self._x_positions)
+        return self.box.left
 
     @property
     def pos_right(self) -> float:
-        return max(self._x_positions)
+        return self.box.right
 
     @property
     def pos_x(self) -> float:
-        return round(avg(self.pos_left, self.pos_right), PRECISION)
+        return self.box.x
 
     @property
     def pos_y(self) -> float:
-        return round(avg(self.pos_bottom, self.pos_top), PRECISION)
+        return self.box.y
 
     @property
     def vertex_topleft(self):
@@ -88,15 +276,15 @@ class VerticesMixin:
 
     @property
     def width(self) -> float:
-        return self.pos_right - self.pos_left
+        return self.box.right - self.box.left
 
     @property
     def height(self):
-        return self.pos_bottom - self.pos_top
+        return self.box.bottom - self.box.top
 
     @property
     def center(self) -> Vertex:  # to a global precision
-        return self.pos_x, self.pos_y
+        return self.box.x, self.box.y
 
 
 @dataclass(frozen=True, eq=True)
@@ -122,14 +310,18 @@ class Symbol(VerticesMixin):
 class Word(VerticesMixin):
     raw: t.Dict[str, t.Any]
 
-    @property
+    @cached_property
     def symbols(self) -> t.List[Symbol]:
         return list(map(Symbol, self.raw['symbols']))
 
-    @property
+    @cached_property
     def _text(self) -> str:
         return ''.join(map(str, self.symbols))
 
+    @property
+    def symbol_widths(self) -> t.List[float]:
+        return [symbol.width for symbol in self.symbols]
+
     @property
     def _char_width(self):
         return self.width / len(self._text)
@@ -149,7 +341,7 @@ class Word(VerticesMixin):
 class Paragraph(VerticesMixin):
     raw: t.Dict[str, t.Any]
 
-    @property
+    @cached_property
     def words(self) -> t.List[Word]:
         return list(map(Word, self.raw['words']))
 
@@ -172,8 +364,8 @@ class Paragraph(VerticesMixin):
 class Block(VerticesMixin):
     raw: t.Dict[str, t.Any]
 
-    @property
-    def paragraphs(self):
+    @cached_property
+    def paragraphs(self) -> t.List[Paragraph]:
         return list(map(Paragraph, self.raw['paragraphs']))
 
     @property
@@ -204,7 +396,7 @@ class Annotation:
     def confidence(self) -> float:
         return self.raw['confidence']
 
-    @property
+    @cached_property
     def blocks(self) -> t.List[Block]:
         return list(map(Block, self.raw['blocks']))
 
@@ -216,19 +408,20 @@ class Annotation:
 class Line(VerticesMixin):
     raw: t.List[Word]
 
-    @property
+    @cached_property
     def words(self) -> t.List[Word]:
         return list(sorted(self.raw, key=lambda w: w.pos_x))
 
-    @property
+    @cached_property
     def vertices(self) -> BoxVertices:  # override - this is an aggregation object
         """
         :return: (left-top, right-top, right-bottom, left-bottom)
         """
-        top = self.words[0].pos_top
-        bottom = self.words[0].pos_bottom
-        left = self.words[0].pos_left
-        right = self.words[-1].pos_right
+        first, last = self.words[0], self.words[-1]
+        top = first.pos_top
+        bottom = first.pos_bottom
+        left = first.pos_left
+        right = last.pos_right
 
         return (left, top), (right, top), (right, bottom), (left, bottom)
 
@@ -236,7 +429,7 @@ class Line(VerticesMixin):
     def _char_width(self):
         return self.width / len(self._text)
 
-    @property
+    @cached_property
     def _text(self) -> str:
         return ' '.join(map(str, self.words))
 
@@ -247,6 +440,23 @@ class Line(VerticesMixin):
         return self._text
 
 
+@dataclass(frozen=True, eq=True)
+class Cell(Line):
+    """
+    words of a single table cell, e.g. a number OCR split into '1' and '272', read as one word
+    """
+    @cached_property
+    def _text(self) -> str:
+        return ''.join(map(str, self.words))
+
+    @property
+    def symbol_widths(self) -> t.List[float]:
+        return list(chain(*(word.symbol_widths for word in self.words)))
+
+    def __repr__(self):
+        return f'<Cell: {self._text}>'
+
+
 @dataclass(frozen=True, eq=True)
 class PaddedLine:
     line: Line
@@ -260,8 +470,43 @@ class PaddedLine:
         return ' ' * round(PRINT_SCALE * self.line.pos_left / self.char_width) + self._text
 
 
+class PageLayout:
+    """
+    words of a page and the lines they form - all `ReportPage` reads, shared by `Page` decoded from
+    the JSON and `PackedPage` read from a `Geometry`
+    """
+    pagenum: int
+    words: t.List[VerticesMixin]
+
+    @cached_property
+    def _word_spans(self) -> np.ndarray:
+        """
+        :return: (n_words, 2) array of (top, bottom) for `self.words`
+        """
+        return np.array([(word.pos_top, word.pos_bottom) for word in self.words], dtype=float).reshape(-1, 2)
+
+    @property
+    def lines(self) -> t.Generator[Line, None, None]:
+        """
+        words are ordered by their vertical centre and a new line starts wherever the gap to the previous
+        centre exceeds `LINE_TOLERANCE` of the median word height, so slightly skewed rows stay together
+        """
+        words = self.words
+        if not words:
+            return
+
+        spans = self._word_spans
+        centres = spans.mean(axis=1)
+        tolerance = LINE_TOLERANCE * np.median(spans[:, 1] - spans[:, 0])
+        order = np.argsort(centres, kind='stable')
+        breaks = np.flatnonzero(np.diff(centres[order]) > tolerance) + 1
+
+        for indices in np.split(order, breaks):
+            yield Line([words[i] for i in indices])
+
+
 @dataclass(frozen=True, eq=True)
-class Page:
+class Page(PageLayout):
     filename: str
     raw: t.Dict[str, t.Any]
 
@@ -284,28 +529,203 @@ class Page:
     def text(self) -> str:
         return self._data['text']
 
-    @property
+    @cached_property
     def _annotations(self) -> t.List[Annotation]:
         return list(map(Annotation, self._data['pages']))
 
-    @property
+    @cached_property
     def paragraphs(self) -> t.List[Paragraph]:
         annotations = self._annotations
         blocks: t.Iterable[Block] = chain(*(a.blocks for a in annotations))
         return list(chain(*(b.paragraphs for b in blocks)))
 
-    @property
+    @cached_property
     def words(self) -> t.List[Word]:
         return list(chain(*((paragraph.words for paragraph in self.paragraphs))))
 
+
+@dataclass(frozen=True, eq=True)
+class PackedWord(VerticesMixin):
+    """
+    a word read from a `Geometry` row instead of a Vision dict: its box, text and symbol widths, which is what
+    lines and `ReportPage` use of a `Word`
+    """
+    raw: int
+    geometry: 'Geometry'
+
+    @cached_property
+    def vertices(self) -> BoxVertices:
+        return list(map(tuple, self.geometry.vertices[self.raw].tolist()))
+
+    @cached_property
+    def box(self) -> Box:
+        return Box(*self.geometry.boxes[self.raw].tolist())
+
     @property
-    def lines(self) -> t.Generator[Line, None, None]:
-        by = lambda word: word.pos_y
-        words = sorted(self.words, key=by)
-        lines = groupby(words, key=by)
+    def symbol_widths(self) -> t.List[float]:
+        return self.geometry.word_symbol_widths(self.raw)
+
+    @cached_property
+    def _text(self) -> str:
+        return self.geometry.word_text(self.raw)
+
+    def __repr__(self):
+        return f'<PackedWord: {self._text}>'
 
-        for key, line in lines:
-            yield Line(list(line))
+    def __str__(self):
+        return self._text
+
+
+@dataclass(frozen=True, eq=True)
+class PackedPage(PageLayout):
+    """
+    the words of a page read from a `Geometry`; the rest of the annotation is not packed, decode the JSON
+    with `DocumentFile.pages` for it
+    """
+    filename: str
+    raw: int
+    geometry: 'Geometry'
+
+    def __repr__(self) -> str:
+        return f'<PackedPage #{self.pagenum} of {self.filename}>'
+
+    @property
+    def pagenum(self) -> int:
+        return int(self.geometry.page_numbers[self.raw])
+
+    @property
+    def _word_range(self) -> range:
+        return range(*self.geometry.page_offsets[self.raw:self.raw + 2].tolist())
+
+    @cached_property
+    def words(self) -> t.List[PackedWord]:
+        return [PackedWord(i, self.geometry) for i in self._word_range]
+
+    @cached_property
+    def _word_spans(self) -> np.ndarray:
+        words = self._word_range
+        return np.array(self.geometry.boxes[words.start:words.stop, 1::2])
+
+
+def pack_pages(pages: t.Iterable[PageLayout]) -> t.Dict[str, np.ndarray]:
+    """
+    :return: the words of `pages` as flat arrays; `*_offsets` hold where each page, word text or word's
+        symbols start, with one extra entry for the end
+    """
+    page_numbers, page_offsets = [], [0]
+    vertices, texts, text_offsets = [], [], [0]
+    symbol_widths, symbol_offsets = [], [0]
+    for page in pages:
+        for word in page.words:
+            vertices.append(word.vertices)
+            texts.append(word._text)
+            text_offsets.append(text_offsets[-1] + len(word._text))
+            symbol_widths.extend(word.symbol_widths)
+            symbol_offsets.append(len(symbol_widths))
+        page_numbers.append(page.pagenum)
+        page_offsets.append(len(vertices))
+
+    return {
+        'page_numbers': np.array(page_numbers, dtype=np.int32),
+        'page_offsets': np.array(page_offsets, dtype=np.int64),
+        'vertices': np.array(vertices, dtype=float).reshape(-1, 4, 2),
+        'text': np.frombuffer(''.join(texts).encode(), dtype=np.uint8),
+        'text_offsets': np.array(text_offsets, dtype=np.int64),
+        'symbol_widths': np.array(symbol_widths, dtype=float),
+        'symbol_offsets': np.array(symbol_offsets, dtype=np.int64),
+    }
+
+
+def _source_stamp(json_path: str) -> np.ndarray:
+    stat = os.stat(json_path)
+    return np.array([GEOMETRY_VERSION, stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+
+
+class Geometry:
+    """
+    Word geometry of a Vision response - page numbers, word text and vertices, symbol widths - packed into
+    memory-mapped arrays in a `.geometry` directory next to the JSON (see `columnar.save_columns`).
+
+    The directory is written the first time a response is opened and rewritten whenever the JSON changes,
+    so repeated runs read a few arrays instead of decoding the JSON.
+    """
+    def __init__(self, columns: t.Dict[str, np.ndarray]):
+        self.page_numbers = columns['page_numbers']
+        self.page_offsets = columns['page_offsets']
+        self.vertices = columns['vertices']
+        self._text = columns['text']
+        self.text_offsets = columns['text_offsets']
+        self.symbol_widths = columns['symbol_widths']
+        self.symbol_offsets = columns['symbol_offsets']
+
+    @staticmethod
+    def path(json_path: str) -> str:
+        return json_path.rsplit('.', 1)[0] + GEOMETRY_SUFFIX
+
+    @classmethod
+    def open(cls, json_path: str) -> 'Geometry':
+        path = cls.path(json_path)
+        try:
+            columns = load_columns(path)
+            if np.array_equal(columns['source'], _source_stamp(json_path)):
+                return cls(columns)
+        except (FileNotFoundError, KeyError):
+            pass
+        return cls.build(json_path)
+
+    @classmethod
+    def build(cls, json_path: str) -> 'Geometry':
+        """
+        packs the JSON, streamed page by page, and replaces the `.geometry` directory as a whole
+        """
+        stamp = _source_stamp(json_path)
+        with profiler.stage('pack'):
+            columns = pack_pages(Page(json_path, raw) for raw in iter_pages_data(json_path))
+        profiler.count('sidecars built')
+        path = cls.path(json_path)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        save_columns(tmp_path, {**columns, 'source': stamp})
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        return cls(load_columns(path))
+
+    @cached_property
+    def text(self) -> str:
+        """
+        text of all words, one after another
+        """
+        return bytes(self._text).decode()
+
+    @cached_property
+    def boxes(self) -> np.ndarray:
+        """
+        :return: (words, 4) array of left, top, right, bottom, as `Box.from_vertices` computes them
+        """
+        xs, ys = self.vertices[:, :, 0], self.vertices[:, :, 1]
+        return np.stack([xs.min(axis=1), ys.min(axis=1), xs.max(axis=1), ys.max(axis=1)], axis=1)
+
+    @cached_property
+    def _text_bounds(self) -> t.List[int]:
+        return self.text_offsets.tolist()
+
+    @cached_property
+    def _symbol_bounds(self) -> t.List[int]:
+        return self.symbol_offsets.tolist()
+
+    @cached_property
+    def _symbol_widths(self) -> t.List[float]:
+        return self.symbol_widths.tolist()
+
+    # per-word lookups go through plain lists - indexing a memmap element by element costs more than reading it
+    def word_text(self, word: int) -> str:
+        return self.text[self._text_bounds[word]:self._text_bounds[word + 1]]
+
+    def word_symbol_widths(self, word: int) -> t.List[float]:
+        return self._symbol_widths[self._symbol_bounds[word]:self._symbol_bounds[word + 1]]
+
+    def pages(self, filename: str) -> t.Iterator[PackedPage]:
+        for i in range(len(self.page_numbers)):
+            yield PackedPage(filename, i, self)
 
 
 @dataclass(frozen=True, eq=True)
@@ -314,16 +734,34 @@ class DocumentFile:
 
     @property
     def _json_data(self) -> t.Dict[str, t.Any]:
-        with open(self.json_path) as f:
-            return loads(f.read())
+        return _load_document(self.json_path, getmtime(self.json_path))
 
     @property
     def _pages_data(self):
         return self._json_data['responses'][0]['responses']
 
-    @property
+    @cached_property
     def pages(self) -> t.List[Page]:
         return [Page(self.json_path, raw) for raw in self._pages_data]
 
+    @cached_property
+    def geometry(self) -> Geometry:
+        return Geometry.open(self.json_path)
+
+    def iter_pages(self) -> t.Iterator[PageLayout]:
+        """
+        words and lines of each page, read from the packed `geometry` unless the JSON is decoded already -
+        use `pages` for the rest of the annotation
+        """
+        if 'pages' in self.__dict__:
+            return iter(self.pages)
+        return self.geometry.pages(self.json_path)
+
+    @cached_property
+    def page_count(self) -> int:
+        if 'pages' in self.__dict__:
+            return len(self.pages)
+        return peek_page_count(self.json_path)
+
     def __repr__(self):
-        return f'<DocumentFile: {self.json_path} ({len(self.pages)} pages)>'
+        return f'<DocumentFile: {self.json_path} ({self.page_count} pages)>'
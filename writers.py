@@ -0,0 +1,124 @@
+import typing as t
+import os
+import shutil
+from abc import ABC, abstractmethod
+from json import dumps, loads
+from textwrap import indent
+
+import numpy as np
+
+from columnar import DictionaryColumn, save_columns, padded_matrix
+
+Entry = t.Dict[str, t.Any]
+
+NDJSON_EXTENSIONS = ('.ndjson', '.jsonl')
+
+
+class EntryWriter(ABC):
+    """
+    writes entries as they are produced instead of collecting them first. They go to a temporary file which
+    replaces `path` only when the block exits without an exception, so an aborted run cannot leave output
+    that looks complete.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._tmp_path = f'{path}.{os.getpid()}.tmp'
+        self._file: t.Optional[t.TextIO] = None
+
+    def __enter__(self) -> 'EntryWriter':
+        self._file = open(self._tmp_path, 'w')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+        if exc_type is None:
+            os.replace(self._tmp_path, self.path)
+        else:
+            os.remove(self._tmp_path)
+
+    @abstractmethod
+    def write(self, entry: Entry):
+        pass
+
+    def flush(self):
+        self._file.flush()
+
+
+class JsonArrayWriter(EntryWriter):
+    """
+    produces the same document as `dumps(entries, indent=2)`, one entry at a time
+    """
+    _count = 0
+
+    def write(self, entry: Entry):
+        self._file.write(',\n' if self._count else '[\n')
+        self._file.write(indent(dumps(entry, indent=2), '  '))
+        self._count += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self._file.write('\n]' if self._count else '[]')
+        super().__exit__(exc_type, exc_value, traceback)
+
+
+class NdjsonWriter(EntryWriter):
+    """
+    JSON Lines - one entry per line
+    """
+    def write(self, entry: Entry):
+        self._file.write(dumps(entry))
+        self._file.write('\n')
+
+
+class ColumnarWriter(EntryWriter):
+    """
+    `path` becomes a directory of memory-mappable .npy columns (see `columnar.load_columns`): dictionary-encoded
+    `name`, `measured` date, `per_30_days` and the `values` matrix. Columns are only written on a clean exit.
+    """
+    def __enter__(self) -> 'ColumnarWriter':
+        self._names: t.List[str] = []
+        self._measured: t.List[str] = []
+        self._per_30_days: t.List[float] = []
+        self._values: t.List[t.List[float]] = []
+        return self
+
+    def write(self, entry: Entry):
+        self._names.append(entry['name'])
+        self._measured.append(entry['measured'][:10])
+        self._per_30_days.append(entry['per_30_days'])
+        self._values.append(entry['values'])
+
+    def flush(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            return
+        save_columns(self._tmp_path, {
+            'name': DictionaryColumn.encode(self._names),
+            'measured': np.array(self._measured, dtype='datetime64[D]'),
+            'per_30_days': np.array(self._per_30_days, dtype=float),
+            'values': padded_matrix(self._values),
+        })
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self._tmp_path, self.path)
+
+
+WRITERS: t.Dict[str, t.Type[EntryWriter]] = {
+    'json': JsonArrayWriter,
+    'ndjson': NdjsonWriter,
+    'columns': ColumnarWriter,
+}
+
+
+def read_entries(path: str) -> t.Iterator[Entry]:
+    """
+    JSON Lines files are read lazily line by line, JSON arrays are decoded whole
+    """
+    with open(path) as f:
+        if path.endswith(NDJSON_EXTENSIONS):
+            for line in f:
+                if line.strip():
+                    yield loads(line)
+        else:
+            yield from loads(f.read())